@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Post, Comment, Group
+from . import search
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -8,6 +9,12 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ("pub_date",)
     empty_value_display = "-пусто-"
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search.available() or not search.to_match(search_term):
+            return super().get_search_results(request, queryset,
+                                              search_term)
+        return queryset.filter(pk__in=search.matching(search_term)), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ("title", "description")
@@ -17,6 +24,12 @@ class GroupAdmin(admin.ModelAdmin):
 class CommentAdmin(admin.ModelAdmin):
     list_display = ("post", "author", "text")
     search_fields = ("text",)
+    # Комментарии могут быть в другой базе: без JOIN с постами и авторами.
+    list_select_related = ()
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('post',
+                                                              'author')
 
 
 admin.site.register(Post, PostAdmin)
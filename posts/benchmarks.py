@@ -0,0 +1,194 @@
+"""Замеры страниц на синтетических данных растущего объёма.
+
+Для каждого размера (число постов) набор данных из dataset.Generator
+дополняется до нужного объёма, после чего каждая страница из CASES
+запрашивается тестовым клиентом с пустым кэшем. Записывается число
+SQL-запросов во всех базах из DATABASES, время в SQL, время вне SQL
+(view и шаблоны) и пик выделенной памяти по tracemalloc.
+
+check() сверяет результаты с бюджетами BUDGETS и требует, чтобы число
+запросов не зависело от объёма данных, а время росло не больше чем
+в GROWTH_LIMIT раз, пока данные растут на порядки.
+"""
+import io
+import statistics
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import ExitStack
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+
+from . import timeline
+from .dataset import Generator
+from .models import Follow, Group, Post, User
+
+Budget = namedtuple('Budget', ['queries', 'sql_ms', 'total_ms', 'peak_kb'])
+Measurement = namedtuple('Measurement', ['case', 'size', 'queries', 'sql_ms',
+                                         'other_ms', 'peak_kb'])
+
+# Запросы считаются с сессией и пользователем во всех базах; время —
+# на пустом кэше. С SOCIAL_DATABASE ленте подписок нужен лишний запрос:
+# подписки читаются из своей базы списком.
+BUDGETS = {
+    'index': Budget(queries=4, sql_ms=50, total_ms=500, peak_kb=6144),
+    'group_posts': Budget(queries=5, sql_ms=50, total_ms=500, peak_kb=6144),
+    'profile': Budget(queries=6, sql_ms=50, total_ms=500, peak_kb=6144),
+    'post_view': Budget(queries=6, sql_ms=50, total_ms=500, peak_kb=6144),
+    'follow_index': Budget(queries=6, sql_ms=80, total_ms=500, peak_kb=6144),
+    'add_comment': Budget(queries=8, sql_ms=50, total_ms=300, peak_kb=2048),
+}
+GROWTH_LIMIT = 3
+
+
+class Fixture:
+    """Растущий набор данных и объекты, на которых меряются страницы."""
+
+    def __init__(self, users=200, groups=10, follows=20, seed=0,
+                 batch_size=1000):
+        self.generator = Generator(seed=seed, batch_size=batch_size)
+        self.users = self.generator.users(users, prefix='bench')
+        self.groups = self.generator.groups(groups, prefix='bench')
+        self.authors = self.generator.popularity(self.users)
+        self.generator.follows(follows, self.users, self.authors)
+        self.reader = User.objects.get(pk=self.users[-1])
+        # Читатель подписан на самых популярных авторов.
+        for author in self.authors[0][:5]:
+            if author != self.reader.pk:
+                Follow.objects.get_or_create(user=self.reader,
+                                             author_id=author)
+        self.size = 0
+
+    def grow(self, size):
+        if size > self.size:
+            posts = self.generator.posts(size - self.size, self.authors,
+                                         self.groups)
+            self.generator.comments(size - self.size, self.users, posts)
+            self.size = size
+            call_command('recount', stdout=io.StringIO())
+        timeline.rebuild(self.reader)
+        self.author = User.objects.get(pk=self.authors[0][0])
+        self.group = Group.objects.get(pk=self.groups[0])
+        self.post = (Post.objects.filter(author=self.author)
+                     .order_by('-comment_count').first())
+
+
+def cases(fixture):
+    author, post = fixture.author.username, fixture.post
+    return [
+        ('index', 'get', reverse('index'), {}),
+        ('group_posts', 'get', reverse('group', args=[fixture.group.slug]),
+         {}),
+        ('profile', 'get', reverse('profile', args=[author]), {}),
+        ('post_view', 'get', reverse('post', args=[author, post.pk]), {}),
+        ('follow_index', 'get', reverse('follow_index'), {}),
+        ('add_comment', 'post',
+         reverse('add_comment', args=[author, post.pk]),
+         {'text': 'Замер'}),
+    ]
+
+
+class Queries:
+    """Число и время запросов; подключается как execute_wrapper."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.time += time.perf_counter() - started
+
+
+def _request(client, method, url, data):
+    cache.clear()
+    response = getattr(client, method)(url, data)
+    if response.status_code >= 400:
+        raise AssertionError(f'{url}: ответ {response.status_code}')
+
+
+def measure(client, case, size, repeat=3):
+    """Время — медиана repeat запросов, память — отдельным запросом.
+
+    tracemalloc замедляет код в разы, поэтому при замере времени он
+    выключен.
+    """
+    name, method, url, data = case
+    runs = []
+    for _ in range(repeat):
+        queries = Queries()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(queries))
+            _request(client, method, url, data)
+        total = (time.perf_counter() - started) * 1000
+        sql = queries.time * 1000
+        runs.append((queries.count, sql, total - sql))
+    tracemalloc.start()
+    try:
+        _request(client, method, url, data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return Measurement(
+        name, size, max(run[0] for run in runs),
+        statistics.median(run[1] for run in runs),
+        statistics.median(run[2] for run in runs), peak / 1024)
+
+
+def run(sizes, repeat=3, **fixture_options):
+    fixture = Fixture(**fixture_options)
+    results = []
+    for size in sorted(sizes):
+        fixture.grow(size)
+        client = Client()
+        client.force_login(fixture.reader)
+        for case in cases(fixture):
+            results.append(measure(client, case, size, repeat))
+    return results
+
+
+def check(results, timing=True):
+    """Список нарушений бюджетов и роста; пустой — всё в порядке."""
+    problems = []
+    by_case = {}
+    for result in results:
+        by_case.setdefault(result.case, []).append(result)
+        budget = BUDGETS[result.case]
+        if result.queries > budget.queries:
+            problems.append(f'{result.case} @ {result.size}: '
+                            f'{result.queries} запросов > {budget.queries}')
+        if not timing:
+            continue
+        if result.sql_ms > budget.sql_ms:
+            problems.append(f'{result.case} @ {result.size}: SQL '
+                            f'{result.sql_ms:.1f} мс > {budget.sql_ms}')
+        if result.sql_ms + result.other_ms > budget.total_ms:
+            problems.append(f'{result.case} @ {result.size}: всего '
+                            f'{result.sql_ms + result.other_ms:.1f} мс '
+                            f'> {budget.total_ms}')
+        if result.peak_kb > budget.peak_kb:
+            problems.append(f'{result.case} @ {result.size}: память '
+                            f'{result.peak_kb:.0f} КБ > {budget.peak_kb}')
+    for case, series in by_case.items():
+        smallest, largest = series[0], series[-1]
+        if largest.queries != smallest.queries:
+            problems.append(f'{case}: число запросов зависит от объёма '
+                            f'({smallest.queries} → {largest.queries})')
+        if timing:
+            before = smallest.sql_ms + smallest.other_ms
+            after = largest.sql_ms + largest.other_ms
+            if after > GROWTH_LIMIT * max(before, 1):
+                problems.append(f'{case}: время выросло с {before:.1f} '
+                                f'до {after:.1f} мс')
+    return problems
@@ -0,0 +1,80 @@
+"""Учёт ссылок на файлы картинок и сборка мусора.
+
+ImageBlob.refs обновляется через F() из сигналов Post. Когда ссылок
+не остаётся, в orphaned ставится время; collect() удаляет такие файлы
+(вместе с миниатюрами) не раньше чем через POSTS_IMAGE_GC_GRACE секунд,
+чтобы не удалить файл, на который как раз сохраняется новый пост.
+Перед удалением ссылки всё равно проверяются по таблице постов.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Count, F
+from django.utils import timezone
+from sorl.thumbnail import delete as delete_thumbnails
+
+from . import thumbnails
+from .models import ImageBlob, Post
+
+
+def recount(names):
+    """Пересчитывает ссылки на файлы names по таблице постов."""
+    names = set(names)
+    counted = dict(Post.objects.filter(image__in=names).order_by()
+                   .values_list('image').annotate(refs=Count('pk')))
+    existing = set(ImageBlob.objects.filter(name__in=names)
+                   .values_list('name', flat=True))
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=name) for name in names - existing],
+        ignore_conflicts=True)
+    now = timezone.now()
+    for name in names:
+        refs = counted.get(name, 0)
+        blob = ImageBlob.objects.filter(name=name)
+        if refs:
+            blob.update(refs=refs, orphaned=None)
+        else:
+            blob.filter(orphaned=None).update(orphaned=now)
+            blob.update(refs=0)
+
+
+def attach(name):
+    if not name:
+        return
+    updated = ImageBlob.objects.filter(name=name).update(
+        refs=F('refs') + 1, orphaned=None)
+    if not updated:
+        recount([name])
+
+
+def release(name):
+    if not name:
+        return
+    blob = ImageBlob.objects.filter(name=name)
+    if not blob.filter(refs__gt=0).update(refs=F('refs') - 1):
+        recount([name])
+    blob.filter(refs=0, orphaned=None).update(orphaned=timezone.now())
+
+
+def collect(batch_size=500, grace=None):
+    """Удаляет файлы без ссылок пачками; возвращает число удалённых."""
+    if grace is None:
+        grace = settings.POSTS_IMAGE_GC_GRACE
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    deleted = 0
+    while True:
+        names = list(ImageBlob.objects.filter(orphaned__lt=cutoff)
+                     .order_by('orphaned')
+                     .values_list('name', flat=True)[:batch_size])
+        if not names:
+            return deleted
+        used = set(Post.objects.filter(image__in=names)
+                   .values_list('image', flat=True))
+        if used:
+            recount(used)
+        unused = [name for name in names if name not in used]
+        for name in unused:
+            # Удаляет и миниатюры, и их записи в key-value хранилище sorl.
+            delete_thumbnails(thumbnails.source_file(name))
+        ImageBlob.objects.filter(name__in=unused).delete()
+        deleted += len(unused)
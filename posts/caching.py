@@ -0,0 +1,139 @@
+"""Версионированные ключи кэша лент.
+
+У каждой ленты (общая, группы, автора) есть номер поколения. Он входит
+в ключи кэша страниц и фрагментов и увеличивается при изменении постов
+и комментариев, поэтому кэш живёт долго, а автор сразу видит свою запись.
+
+Страница, отрисованная с реплики, могла не увидеть последних записей.
+Такие страницы и фрагменты кэшируются под своими ключами (feed_version)
+и не дольше окна REPLICA_STICKY_SECONDS (feed_timeout), так что читатели
+основной базы их не получают, а отставание не закрепляется в кэше.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.cache import cache_page
+
+from yatube import metrics, routers
+
+from .templatetags.personalize import fill
+
+ALL = 'all'
+
+
+def group_scope(slug):
+    return f'group:{slug}'
+
+
+def author_scope(username):
+    return f'author:{username}'
+
+
+def scopes_for(post):
+    scopes = [ALL, author_scope(post.author.username)]
+    if post.group_id is not None:
+        scopes.append(group_scope(post.group.slug))
+    return scopes
+
+
+def _key(scope):
+    return f'feed-generation:{scope}'
+
+
+def _initial():
+    # Начинаем не с 1: если счётчик вытеснят из кэша, новое поколение
+    # не совпадёт со старыми закэшированными страницами.
+    return int(time.time() * 1000)
+
+
+def generation(*scopes):
+    keys = [_key(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    missing = {key: _initial() for key in keys if key not in found}
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return '.'.join(str(found[key]) for key in keys)
+
+
+def feed_version(*scopes):
+    """Поколение лент для ключей кэша; у страниц с реплики — свои ключи."""
+    version = generation(*scopes)
+    replica = routers.current_replica()
+    return f'{version}.{replica}' if replica else version
+
+
+def feed_timeout():
+    timeout = settings.POSTS_FEED_CACHE_TIMEOUT
+    if routers.current_replica():
+        return min(timeout, settings.REPLICA_STICKY_SECONDS)
+    return timeout
+
+
+def bump(*scopes):
+    for scope in set(scopes):
+        try:
+            cache.incr(_key(scope))
+        except ValueError:
+            cache.set(_key(scope), _initial(), None)
+
+
+def _member_page(view, version, request, *args, **kwargs):
+    """Страница для авторизованных: одна копия с метками на всех.
+
+    Метки пользовательских частей заполняет fill() на каждый запрос,
+    поэтому при попадании представление не выполняется вовсе.
+    """
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    key = f'feed-page.{view.__name__}:{version}:{path}'
+    cached = cache.get(key)
+    metrics.cache_lookup('page', cached is not None, view=view.__name__)
+    if cached is None:
+        request.defer_personalization = True
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200 or response.streaming:
+            return response
+        cached = (response.content.decode(response.charset),
+                  response['Content-Type'])
+        cache.set(key, cached, feed_timeout())
+    content, content_type = cached
+    response = HttpResponse(fill(content, request.user),
+                            content_type=content_type)
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def cache_feed(*scopes):
+    """cache_page с ключом, зависящим от поколения ленты.
+
+    scopes — функции от kwargs представления, возвращающие имя ленты.
+    Анонимы получают страницу из cache_page. Для авторизованных страница
+    кэшируется одна на всех с метками вместо имени пользователя и ссылок
+    на редактирование (см. templatetags.personalize).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            version = feed_version(*(scope(**kwargs) for scope in scopes))
+            if request.user.is_authenticated:
+                return _member_page(view, version, request, *args, **kwargs)
+            cached = cache_page(feed_timeout(),
+                                key_prefix=f'{view.__name__}:{version}')
+            rendered = []
+
+            def render(*args, **kwargs):
+                rendered.append(True)
+                return view(*args, **kwargs)
+
+            response = cached(render)(request, *args, **kwargs)
+            metrics.cache_lookup('page', not rendered, view=view.__name__)
+            return response
+        return wrapper
+    return decorator
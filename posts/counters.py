@@ -0,0 +1,102 @@
+"""Денормализованные счётчики: Post.comment_count и UserStats.
+
+Обновляются атомарно через F() из сигналов, поэтому страницы профиля
+и поста не делают COUNT. Расхождения чинит команда recount.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from yatube.routers import same_database
+
+from .models import Comment, Follow, Post, User, UserStats
+
+
+def stats_for(user):
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        recount_users(User.objects.filter(pk=user.pk))
+        return UserStats.objects.get(user=user)
+
+
+def _bump_user(user_id, **deltas):
+    # Если строки нет, её пересчитает stats_for при чтении. Создавать её
+    # здесь нельзя: при удалении пользователя сигналы его постов пришли бы
+    # уже после удаления UserStats и оставили бы строку без пользователя.
+    UserStats.objects.filter(user_id=user_id).update(
+        **{field: F(field) + delta for field, delta in deltas.items()})
+
+
+def _bump_post(post_id, delta):
+    if post_id is not None:
+        Post.objects.filter(pk=post_id).update(
+            comment_count=F('comment_count') + delta)
+
+
+def post_added(post):
+    _bump_user(post.author_id, posts=1)
+
+
+def post_deleted(post):
+    _bump_user(post.author_id, posts=-1)
+
+
+def comment_added(comment):
+    _bump_post(comment.post_id, 1)
+
+
+def comment_deleted(comment):
+    _bump_post(comment.post_id, -1)
+
+
+def follow_added(follow):
+    _bump_user(follow.author_id, followers=1)
+    _bump_user(follow.user_id, following=1)
+
+
+def follow_deleted(follow):
+    _bump_user(follow.author_id, followers=-1)
+    _bump_user(follow.user_id, following=-1)
+
+
+def _count(queryset, field):
+    counted = (queryset.filter(**{field: OuterRef('pk')}).order_by()
+               .values(field).annotate(count=Count('pk')).values('count'))
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+def _counts(queryset, field, ids):
+    """{id: число строк} — для таблиц из другой базы, где нет подзапроса."""
+    return dict(queryset.filter(**{f'{field}__in': ids}).order_by()
+                .values_list(field).annotate(count=Count('pk')))
+
+
+def recount_posts(posts):
+    if same_database(Comment, Post):
+        posts.update(comment_count=_count(Comment.objects, 'post'))
+        return
+    found = list(posts.only('pk'))
+    counts = _counts(Comment.objects, 'post', [post.pk for post in found])
+    for post in found:
+        post.comment_count = counts.get(post.pk, 0)
+    Post.objects.bulk_update(found, ['comment_count'])
+
+
+def recount_users(users):
+    ids = list(users.values_list('pk', flat=True))
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in ids], ignore_conflicts=True)
+    stats = UserStats.objects.filter(user__in=ids)
+    if same_database(Follow, UserStats):
+        stats.update(posts=_count(Post.objects, 'author'),
+                     followers=_count(Follow.objects, 'author'),
+                     following=_count(Follow.objects, 'user'))
+        return
+    stats.update(posts=_count(Post.objects, 'author'))
+    followers = _counts(Follow.objects, 'author', ids)
+    following = _counts(Follow.objects, 'user', ids)
+    found = list(stats.only('pk'))
+    for item in found:
+        item.followers = followers.get(item.user_id, 0)
+        item.following = following.get(item.user_id, 0)
+    UserStats.objects.bulk_update(found, ['followers', 'following'])
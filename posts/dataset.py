@@ -0,0 +1,184 @@
+"""Синтетический набор данных для замеров: команда generate_dataset.
+
+Всё строится из random.Random(seed), а даты отсчитываются назад от
+фиксированного момента now (по умолчанию EPOCH), поэтому один и тот же
+seed на пустой базе даёт одни и те же строки — вплоть до соли пароля
+и uid постов. Первичные ключи назначаются явно, начиная
+с текущего максимума, — так связи известны без повторного чтения
+вставленных строк, а вставка идёт bulk_create пачками по batch_size.
+
+Популярность авторов подчиняется степенному закону: у автора ранга r вес
+1 / r ** alpha. По этим весам выбираются и авторы постов, и на кого
+подписываться, так что появляются и «звёзды» с огромным числом
+подписчиков, и длинный хвост.
+"""
+import io
+import random
+import string
+import uuid
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import router, transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from . import blobs, transfer, uploads
+from .models import Comment, Follow, Group, Post, User
+from .storage import image_storage
+
+PASSWORD = 'password'
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+WORDS = ('котики собаки погода город лес море утро вечер книга кино '
+         'музыка дорога поезд кофе чай работа отпуск друзья семья '
+         'весна лето осень зима снег дождь солнце река горы парк').split()
+
+
+class Generator:
+
+    def __init__(self, seed=0, batch_size=1000, alpha=1.1, days=365,
+                 now=EPOCH):
+        self.random = random.Random(seed)
+        self.batch_size = batch_size
+        self.alpha = alpha
+        self.days = days
+        self.now = now
+
+    def _next_pk(self, model):
+        return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+    def _insert(self, model, objects):
+        """bulk_create пачками, каждая в своей транзакции."""
+        batch, count = [], 0
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                count += self._flush(model, batch)
+        return count + self._flush(model, batch)
+
+    @staticmethod
+    def _flush(model, batch):
+        if not batch:
+            return 0
+        using = router.db_for_write(model)
+        with transaction.atomic(using=using):
+            transfer.bulk_create_dated(model, batch, using)
+        count = len(batch)
+        batch.clear()
+        return count
+
+    def _text(self, low, high):
+        return ' '.join(self.random.choices(WORDS,
+                                            k=self.random.randint(low, high)))
+
+    def _date(self):
+        return self.now - timedelta(seconds=self.random.uniform(
+            0, self.days * 24 * 60 * 60))
+
+    def users(self, count, prefix='user'):
+        first = self._next_pk(User)
+        salt = ''.join(self.random.choices(
+            string.ascii_letters + string.digits, k=12))
+        password = make_password(PASSWORD, salt)
+        self._insert(User, (
+            User(pk=pk, username=f'{prefix}{pk}', password=password,
+                 email=f'{prefix}{pk}@example.com', date_joined=self._date())
+            for pk in range(first, first + count)))
+        return list(range(first, first + count))
+
+    def groups(self, count, prefix='group'):
+        first = self._next_pk(Group)
+        self._insert(Group, (
+            Group(pk=pk, title=f'Группа {pk}', slug=f'{prefix}-{pk}',
+                  description=self._text(5, 20))
+            for pk in range(first, first + count)))
+        return list(range(first, first + count))
+
+    def popularity(self, user_ids):
+        """Накопленные веса для random.choices: степенной закон по рангу."""
+        ranked = list(user_ids)
+        self.random.shuffle(ranked)
+        weights = (1 / (rank ** self.alpha)
+                   for rank in range(1, len(ranked) + 1))
+        return ranked, list(accumulate(weights))
+
+    def images(self, count, size=(800, 600)):
+        """Разные картинки в хранилище; возвращает поля поста для них."""
+        found = []
+        for _ in range(count):
+            color = tuple(self.random.randrange(256) for _ in range(3))
+            image = Image.new('RGB', size, color)
+            image.paste(tuple(255 - c for c in color),
+                        (self.random.randrange(size[0] // 2),
+                         self.random.randrange(size[1] // 2),
+                         size[0] // 2 + self.random.randrange(size[0] // 2),
+                         size[1] // 2 + self.random.randrange(size[1] // 2)))
+            output = io.BytesIO()
+            image.save(output, format='JPEG', quality=80)
+            file = ContentFile(output.getvalue(), name='generated.jpeg')
+            fields = uploads.describe(file)
+            fields['image'] = image_storage.save('posts/generated.jpeg', file)
+            found.append(fields)
+        return found
+
+    def posts(self, count, authors, group_ids, images=(), image_share=0.0):
+        ranked, weights = authors
+        first = self._next_pk(Post)
+
+        def build(pk):
+            fields = {}
+            if images and self.random.random() < image_share:
+                fields = self.random.choice(images)
+            group = None
+            if group_ids and self.random.random() < 0.7:
+                group = self.random.choice(group_ids)
+            author = self.random.choices(ranked, cum_weights=weights)[0]
+            return Post(pk=pk, author_id=author, group_id=group,
+                        text=self._text(5, 60), pub_date=self._date(),
+                        uid=uuid.UUID(int=self.random.getrandbits(128),
+                                      version=4),
+                        **fields)
+
+        self._insert(Post, (build(pk) for pk in range(first, first + count)))
+        if images:
+            blobs.recount(fields['image'] for fields in images)
+        return first, first + count
+
+    def comments(self, count, user_ids, post_range):
+        first = self._next_pk(Comment)
+        low, high = post_range
+        if low == high:
+            return 0
+        return self._insert(Comment, (
+            Comment(pk=pk, post_id=self.random.randrange(low, high),
+                    author_id=self.random.choice(user_ids),
+                    text=self._text(2, 20), created=self._date())
+            for pk in range(first, first + count)))
+
+    def follows(self, average, user_ids, authors):
+        """Каждый подписывается в среднем на average авторов."""
+        ranked, weights = authors
+        limit = len(ranked) - 1
+
+        def build():
+            for user in user_ids:
+                wanted = min(int(self.random.expovariate(1 / average)),
+                             limit) if average else 0
+                chosen = set()
+                # Популярных выбирают часто, поэтому набираем с запасом;
+                # хвост с крошечными весами можно не добрать.
+                for _ in range(10):
+                    if len(chosen) >= wanted:
+                        break
+                    for author in self.random.choices(
+                            ranked, cum_weights=weights,
+                            k=2 * (wanted - len(chosen))):
+                        if author != user and len(chosen) < wanted:
+                            chosen.add(author)
+                for author in sorted(chosen):
+                    yield Follow(user_id=user, author_id=author)
+
+        return self._insert(Follow, build())
@@ -0,0 +1,27 @@
+"""Запросы лент: всё, что выводит карточка поста, грузится сразу.
+
+post_item.html не должен делать запросов: автор и группа приходят
+через select_related, число комментариев хранится в Post.comment_count.
+"""
+from . import timeline
+from .models import Post
+
+
+def cards(queryset):
+    return queryset.select_related('author', 'group')
+
+
+def everything():
+    return cards(Post.objects.all())
+
+
+def for_group(group):
+    return cards(group.posts.all())
+
+
+def for_author(author):
+    return cards(author.posts.all())
+
+
+def for_follower(user):
+    return timeline.Feed(user, everything())
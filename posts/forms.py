@@ -1,4 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+
+from . import uploads
 from .models import Post
 
 from django.forms import ModelForm
@@ -12,6 +15,26 @@ class PostForm(forms.ModelForm):
         fields = ('group', 'text', 'image')
         help_texts = {'group': 'Выберете группу', 'text': 'Введите текст'}
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Файл, обрезанный по размеру, ImageField счёл бы битым —
+        # убираем его из разбора и сообщаем о размере в clean_image.
+        self.oversized = None
+        upload = self.files.get('image')
+        if getattr(upload, 'oversized', False):
+            self.oversized = upload
+            self.files = self.files.copy()
+            self.files.pop('image')
+
+    def clean_image(self):
+        if self.oversized is not None:
+            uploads.check(self.oversized)
+        image = self.cleaned_data.get('image')
+        # Уже сохранённую картинку при редактировании не трогаем.
+        if isinstance(image, UploadedFile):
+            image = uploads.process(image)
+        return image
+
 
 class CommentForm(ModelForm):
     class Meta(object):
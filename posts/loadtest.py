@@ -0,0 +1,325 @@
+"""Нагрузочный прогон смеси запросов: команда load_test.
+
+Запросы идут либо прямо в WSGI-приложение yatube.wsgi.application в том
+же процессе, либо по HTTP на уже запущенный сервер. Каждый исполнитель
+(поток или процесс) держит две сессии — анонимную и вошедшего
+пользователя — с cookie и CSRF-токеном, как у браузера, и выбирает
+сценарии случайно по весам MIX.
+
+В своём процессе прогон идёт с DEBUG=False: иначе в замер попали бы
+debug_toolbar и журнал connection.queries. Сервер по --url должен быть
+запущен так же; ответ с панелью debug_toolbar прерывает прогон.
+
+Записи, комментарии и пользователи для запросов берутся из базы заранее,
+поэтому сначала нужны данные (например, от generate_dataset). Сценарии
+add_comment и new_post пишут в базу.
+"""
+import http.client
+import io
+import math
+import random
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from multiprocessing import get_context
+from urllib.parse import urlencode, urlsplit
+
+from django.db import connections
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from .dataset import PASSWORD, WORDS
+from .models import Group, Post, User
+
+MIX = {
+    'index': 30,
+    'group': 15,
+    'profile': 10,
+    'follow_index': 15,
+    'post_view': 20,
+    'add_comment': 7,
+    'profile_follow': 3,
+    'new_post': 3,
+}
+# Сценарии, которым нужен вошедший пользователь.
+LOGGED_IN = {'follow_index', 'post_view', 'add_comment', 'profile_follow',
+             'new_post'}
+
+# Разметка панели debug_toolbar в странице.
+TOOLBAR_MARKER = b'id="djDebug"'
+
+Sample = namedtuple('Sample', ['scenario', 'seconds', 'ok'])
+Targets = namedtuple('Targets', ['posts', 'groups', 'usernames'])
+
+
+class LoadTestError(Exception):
+    pass
+
+
+def parse_mix(text):
+    """'index=30,post_view=20' -> веса; не названные сценарии выпадают."""
+    mix = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, _, weight = item.partition('=')
+        if name not in MIX:
+            raise LoadTestError(f'Неизвестный сценарий: {name}')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise LoadTestError(f'Вес сценария {name} должен быть числом')
+    if not any(mix.values()):
+        raise LoadTestError('В смеси нет ни одного сценария с весом')
+    return mix
+
+
+def targets(sample=1000):
+    """Случайные записи, группы и авторы для запросов."""
+    posts = list(Post.objects.order_by('?')
+                 .values_list('author__username', 'pk')[:sample])
+    groups = list(Group.objects.order_by('?')
+                  .values_list('slug', flat=True)[:sample])
+    usernames = list(User.objects.filter(is_active=True).order_by('?')
+                     .values_list('username', flat=True)[:sample])
+    if not posts or not usernames:
+        raise LoadTestError('В базе нет записей или пользователей')
+    return Targets(posts, groups, usernames)
+
+
+class Session:
+    """Cookie и CSRF поверх транспорта _send."""
+
+    def __init__(self):
+        self.cookies = {}
+
+    def _send(self, method, path, body, headers):
+        raise NotImplementedError
+
+    def request(self, method, path, data=None):
+        body = urlencode(data or {}).encode()
+        headers = {}
+        if self.cookies:
+            headers['Cookie'] = '; '.join(
+                f'{name}={value}' for name, value in self.cookies.items())
+        if method == 'POST':
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            headers['X-CSRFToken'] = self.cookies.get('csrftoken', '')
+        status, response_headers, content = self._send(method, path, body,
+                                                       headers)
+        for name, value in response_headers:
+            if name.lower() == 'set-cookie':
+                for morsel in SimpleCookie(value).values():
+                    self.cookies[morsel.key] = morsel.value
+        if TOOLBAR_MARKER in content:
+            raise LoadTestError('Сервер отдаёт debug_toolbar, замер был бы '
+                                'искажён; запустите его с DEBUG=False')
+        return status, content
+
+    def login(self, username, password):
+        # Страница входа выдаёт cookie csrftoken.
+        self.request('GET', reverse('login'))
+        status, _ = self.request('POST', reverse('login'),
+                                 {'username': username,
+                                  'password': password})
+        if status != 302:
+            raise LoadTestError(f'Не удалось войти как {username}')
+
+
+class WSGISession(Session):
+    """Запросы прямо в WSGI-приложение текущего процесса."""
+
+    def __init__(self, application):
+        super().__init__()
+        self.application = application
+
+    def _send(self, method, path, body, headers):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': io.StringIO(),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers.items():
+            if name == 'Content-Type':
+                environ['CONTENT_TYPE'] = value
+            else:
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started['status'] = int(status.split()[0])
+            started['headers'] = response_headers
+
+        result = self.application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return started['status'], started['headers'], content
+
+
+class HTTPSession(Session):
+    """Запросы по HTTP с keep-alive к запущенному серверу."""
+
+    def __init__(self, url):
+        super().__init__()
+        parts = urlsplit(url)
+        self.connection = http.client.HTTPConnection(
+            parts.hostname, parts.port or 80, timeout=30)
+
+    def _send(self, method, path, body, headers):
+        try:
+            self.connection.request(method, path, body or None, headers)
+            response = self.connection.getresponse()
+            return (response.status, response.getheaders(),
+                    response.read())
+        except (OSError, http.client.HTTPException):
+            # Соединение переоткроется при следующем запросе.
+            self.connection.close()
+            raise
+
+
+def _session(url):
+    if url:
+        return HTTPSession(url)
+    from yatube.wsgi import application
+    return WSGISession(application)
+
+
+def _scenario(name, rng, targets):
+    """Метод, путь, данные и ожидаемый статус ответа."""
+    author, post_id = rng.choice(targets.posts)
+    text = ' '.join(rng.choices(WORDS, k=rng.randint(3, 20)))
+    if name == 'index':
+        page = rng.randint(1, 3)
+        return 'GET', f'{reverse("index")}?page={page}', None, 200
+    if name == 'group':
+        if not targets.groups:
+            return 'GET', reverse('index'), None, 200
+        slug = rng.choice(targets.groups)
+        return 'GET', reverse('group', args=[slug]), None, 200
+    if name == 'profile':
+        username = rng.choice(targets.usernames)
+        return 'GET', reverse('profile', args=[username]), None, 200
+    if name == 'follow_index':
+        return 'GET', reverse('follow_index'), None, 200
+    if name == 'post_view':
+        return 'GET', reverse('post', args=[author, post_id]), None, 200
+    if name == 'profile_follow':
+        username = rng.choice(targets.usernames)
+        return 'GET', reverse('profile_follow', args=[username]), None, 302
+    if name == 'add_comment':
+        return ('POST', reverse('add_comment', args=[author, post_id]),
+                {'text': text}, 302)
+    return 'POST', reverse('new_post'), {'text': text}, 302
+
+
+def worker(url, mix, targets, deadline, requests, seed, password=PASSWORD):
+    """Гоняет сценарии до deadline или requests запросов."""
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    anonymous, logged_in = _session(url), None
+    samples = []
+    while time.monotonic() < deadline and len(samples) < requests:
+        name = rng.choices(names, weights)[0]
+        session = anonymous
+        if name in LOGGED_IN:
+            if logged_in is None:
+                logged_in = _session(url)
+                logged_in.login(rng.choice(targets.usernames), password)
+            session = logged_in
+        method, path, data, expected = _scenario(name, rng, targets)
+        started = time.perf_counter()
+        try:
+            status, _ = session.request(method, path, data)
+            ok = status == expected
+        except (OSError, http.client.HTTPException):
+            ok = False
+        samples.append(Sample(name, time.perf_counter() - started, ok))
+    return samples
+
+
+def _pooled_worker(*args):
+    # У каждого потока и процесса свои соединения с базой.
+    try:
+        return worker(*args)
+    finally:
+        connections.close_all()
+
+
+def run(mix=None, concurrency=4, duration=10, requests=None, url=None,
+        processes=False, seed=0, password=PASSWORD, sample=1000):
+    """Запускает исполнителей; возвращает (samples, секунд прошло)."""
+    mix = mix or MIX
+    found = targets(sample)
+    per_worker = (math.ceil(requests / concurrency) if requests
+                  else float('inf'))
+    started = time.monotonic()
+    deadline = started + duration
+    arguments = [(url, mix, found, deadline, per_worker, seed + index,
+                  password) for index in range(concurrency)]
+    with override_settings(DEBUG=False) if url is None else nullcontext():
+        if concurrency == 1 and not processes:
+            results = [worker(*arguments[0])]
+        elif processes:
+            # Соединения с базой не должны достаться дочерним процессам.
+            connections.close_all()
+            with ProcessPoolExecutor(
+                    concurrency, mp_context=get_context('fork')) as pool:
+                results = list(pool.map(_pooled_worker, *zip(*arguments)))
+        else:
+            with ThreadPoolExecutor(concurrency) as pool:
+                results = list(pool.map(_pooled_worker, *zip(*arguments)))
+    elapsed = time.monotonic() - started
+    samples = [item for result in results for item in result]
+    if requests:
+        samples = samples[:requests]
+    return samples, elapsed
+
+
+def percentile(values, share):
+    """Ближайший ранг по отсортированному списку."""
+    if not values:
+        return 0.0
+    rank = max(math.ceil(share * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def report(samples, elapsed):
+    """Строки отчёта: по сценариям и итог."""
+    rows = []
+    by_name = {}
+    for item in samples:
+        by_name.setdefault(item.scenario, []).append(item)
+    for name in sorted(by_name, key=lambda name: -len(by_name[name])):
+        rows.append(_row(name, by_name[name], elapsed))
+    rows.append(_row('всего', samples, elapsed))
+    return rows
+
+
+def _row(name, samples, elapsed):
+    times = sorted(item.seconds * 1000 for item in samples)
+    errors = sum(not item.ok for item in samples)
+    return {
+        'scenario': name,
+        'requests': len(samples),
+        'rps': len(samples) / elapsed if elapsed else 0.0,
+        'errors': errors / len(samples) if samples else 0.0,
+        'p50': percentile(times, 0.5),
+        'p95': percentile(times, 0.95),
+        'p99': percentile(times, 0.99),
+    }
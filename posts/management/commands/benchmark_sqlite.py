@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import tempfile
+from threading import local
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+
+from posts import loadtest
+
+# Чтения вперемешку с записями: на такой нагрузке видно, ждут ли
+# читатели блокировку писателя.
+MIX = 'index=30,post_view=25,follow_index=15,add_comment=20,new_post=10'
+
+
+def _copy(connection, path):
+    """Копия базы в режиме журнала по умолчанию, как у новой базы.
+
+    Копируется через backup API того же соединения, поэтому копируются
+    и базы в памяти. Открытой транзакции у соединения быть не должно:
+    backup ждёт, пока она закончится.
+    """
+    connection.ensure_connection()
+    target = sqlite3.connect(path)
+    try:
+        connection.connection.backup(target)
+        target.execute('PRAGMA journal_mode = delete')
+    finally:
+        target.close()
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает профили соединений SQLite на смешанной нагрузке. '
+            'Каждый профиль гоняется на своей временной копии баз, '
+            'поэтому рабочие базы не меняются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', default='default,production',
+                            help='Профили из SQLITE_PROFILES через запятую')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--processes', action='store_true',
+                            help='Исполнители — процессы, а не потоки')
+        parser.add_argument('--duration', type=float, default=10)
+        parser.add_argument('--requests', type=int)
+        parser.add_argument('--mix', default=MIX)
+        parser.add_argument('--password', default=loadtest.PASSWORD)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        profiles = [name.strip() for name in options['profiles'].split(',')
+                    if name.strip()]
+        unknown = set(profiles) - set(settings.SQLITE_PROFILES)
+        if unknown:
+            raise CommandError(
+                f'Неизвестные профили: {", ".join(sorted(unknown))}')
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency должно быть не меньше 1')
+        try:
+            mix = loadtest.parse_mix(options['mix'])
+        except loadtest.LoadTestError as error:
+            raise CommandError(error)
+
+        self.stdout.write(f'{"профиль":<12}{"запросов":>9}{"RPS":>9}'
+                          f'{"ошибки":>9}{"p50, мс":>10}{"p95, мс":>10}'
+                          f'{"p99, мс":>10}{"запись p95":>12}')
+        for name in profiles:
+            try:
+                samples, elapsed = self.run_profile(name, mix, options)
+            except loadtest.LoadTestError as error:
+                raise CommandError(error)
+            total = loadtest.report(samples, elapsed)[-1]
+            writes = loadtest.report(
+                [item for item in samples
+                 if item.scenario in ('add_comment', 'new_post')], elapsed)
+            self.stdout.write(
+                f'{name:<12}{total["requests"]:>9}{total["rps"]:>9.1f}'
+                f'{total["errors"]:>9.1%}{total["p50"]:>10.1f}'
+                f'{total["p95"]:>10.1f}{total["p99"]:>10.1f}'
+                f'{writes[-1]["p95"]:>12.1f}')
+
+    def run_profile(self, name, mix, options):
+        profile = settings.SQLITE_PROFILES[name]
+        with tempfile.TemporaryDirectory(prefix='yatube-sqlite-') as directory:
+            copies = {}
+            for alias in connections:
+                connection = connections[alias]
+                if connection.vendor != 'sqlite' or not (
+                        connection.is_in_memory_db()
+                        or os.path.exists(connection.settings_dict['NAME'])):
+                    continue
+                path = os.path.join(directory, f'{alias}.sqlite3')
+                _copy(connection, path)
+                copies[alias] = {**connection.settings_dict, 'NAME': path,
+                                 'CONN_MAX_AGE': profile['CONN_MAX_AGE']}
+            saved_connections = connections._connections
+            saved_databases = {alias: connections.databases[alias]
+                               for alias in copies}
+            # Все потоки и процессы прогона открывают соединения заново:
+            # уже с PRAGMA профиля и к копиям баз.
+            connections._connections = local()
+            connections.databases.update(copies)
+            try:
+                with override_settings(SQLITE_PROFILE=name):
+                    return loadtest.run(
+                        mix, options['concurrency'], options['duration'],
+                        options['requests'], None, options['processes'],
+                        options['seed'], options['password'])
+            finally:
+                connections.close_all()
+                connections._connections = saved_connections
+                connections.databases.update(saved_databases)
+
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import (override_settings, setup_databases,
+                               setup_test_environment, teardown_databases,
+                               teardown_test_environment)
+
+from posts import benchmarks
+
+LOCAL_CACHE = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+
+class Command(BaseCommand):
+    help = ('Замеряет страницы на синтетических данных растущего объёма '
+            'во временной тестовой базе и сверяет с бюджетами')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='Число записей через запятую')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--follows', type=float, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-timing', action='store_true',
+                            help='Проверять только число запросов')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes: ожидаются целые числа через запятую')
+        setup_test_environment()
+        # Тестовые копии всех баз: с SOCIAL_DATABASE комментарии
+        # и подписки пишутся не в основную.
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            # Замеры чистят кэш, поэтому общий кэш сайта не трогаем;
+            # пустые тестовые реплики читать незачем.
+            with override_settings(CACHES=LOCAL_CACHE,
+                                   DATABASE_REPLICAS=[]):
+                results = benchmarks.run(
+                    sizes, options['repeat'], users=options['users'],
+                    follows=options['follows'], seed=options['seed'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(f'{"страница":<14}{"записей":>9}{"запросов":>10}'
+                          f'{"SQL, мс":>10}{"прочее, мс":>12}{"КБ":>8}')
+        for result in results:
+            self.stdout.write(
+                f'{result.case:<14}{result.size:>9}{result.queries:>10}'
+                f'{result.sql_ms:>10.1f}{result.other_ms:>12.1f}'
+                f'{result.peak_kb:>8.0f}')
+        problems = benchmarks.check(results, timing=not options['no_timing'])
+        if problems:
+            raise CommandError('Бюджеты превышены:\n' + '\n'.join(problems))
+        self.stdout.write(self.style.SUCCESS('Все страницы в бюджете'))
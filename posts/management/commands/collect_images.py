@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts import blobs
+
+
+class Command(BaseCommand):
+    help = 'Удаляет файлы картинок, на которые больше не ссылаются записи'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--grace', type=int, default=None,
+                            help='Сколько секунд файл должен пробыть '
+                                 'без ссылок (по умолчанию '
+                                 'POSTS_IMAGE_GC_GRACE)')
+
+    def handle(self, *args, **options):
+        count = blobs.collect(batch_size=options['batch_size'],
+                              grace=options['grace'])
+        self.stdout.write(f'Удалено файлов: {count}')
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = ('Выгружает пользователей, группы, записи, комментарии '
+            'и подписки в NDJSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('-o', '--output', default='-',
+                            help='Файл; по умолчанию stdout')
+        parser.add_argument('--since',
+                            help='Только записи и комментарии не старше '
+                                 'этой даты (ISO 8601)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('--since: нужна дата в формате ISO 8601')
+        output = self.stdout
+        if options['output'] != '-':
+            output = open(options['output'], 'w', encoding='utf-8')
+        watermark, count = None, 0
+        try:
+            for line, pub_date in transfer.export(since,
+                                                  options['batch_size']):
+                output.write(line + '\n')
+                count += 1
+                if pub_date is not None and (watermark is None
+                                             or pub_date > watermark):
+                    watermark = pub_date
+        finally:
+            if output is not self.stdout:
+                output.close()
+        self.stderr.write(f'Выгружено записей: {count}')
+        if watermark is not None:
+            self.stderr.write(f'Для следующей выгрузки: --since '
+                              f'{watermark.isoformat()}')
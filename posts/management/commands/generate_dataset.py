@@ -0,0 +1,75 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from posts.dataset import EPOCH, Generator
+
+
+def moment(value):
+    parsed = parse_datetime(value)
+    if parsed is None or parsed.tzinfo is None:
+        raise CommandError(f'--now: нужна дата с часовым поясом, '
+                           f'например {EPOCH.isoformat()}')
+    return parsed
+
+
+class Command(BaseCommand):
+    help = ('Создаёт синтетических пользователей, группы, записи, '
+            'комментарии и подписки для замеров производительности')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=200000)
+        parser.add_argument('--follows', type=float, default=20,
+                            help='Среднее число подписок на пользователя')
+        parser.add_argument('--images', type=int, default=0,
+                            help='Сколько разных картинок создать')
+        parser.add_argument('--image-share', type=float, default=0.2,
+                            help='Доля записей с картинкой')
+        parser.add_argument('--alpha', type=float, default=1.1,
+                            help='Показатель степенного закона популярности')
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней распределить даты')
+        parser.add_argument('--now', type=moment, default=EPOCH,
+                            help='Момент, от которого отсчитываются даты '
+                                 '(ISO 8601 с часовым поясом)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='user',
+                            help='Префикс имён пользователей')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Не пересчитывать счётчики и ленты '
+                                 'подписок')
+
+    def step(self, title, function, *args, **kwargs):
+        started = time.monotonic()
+        result = function(*args, **kwargs)
+        self.stdout.write(f'{title}: {time.monotonic() - started:.1f} с')
+        return result
+
+    def handle(self, *args, **options):
+        generator = Generator(seed=options['seed'],
+                              batch_size=options['batch_size'],
+                              alpha=options['alpha'], days=options['days'],
+                              now=options['now'])
+        users = self.step('Пользователи', generator.users, options['users'],
+                          prefix=options['prefix'])
+        groups = self.step('Группы', generator.groups, options['groups'])
+        authors = generator.popularity(users)
+        images = self.step('Картинки', generator.images, options['images'])
+        posts = self.step('Записи', generator.posts, options['posts'],
+                          authors, groups, images, options['image_share'])
+        self.step('Комментарии', generator.comments, options['comments'],
+                  users, posts)
+        self.step('Подписки', generator.follows, options['follows'], users,
+                  authors)
+        if not options['skip_derived']:
+            # bulk_create обходит сигналы, которые ведут эти данные.
+            self.step('Счётчики', call_command, 'recount',
+                      batch_size=options['batch_size'], stdout=self.stdout)
+            self.step('Ленты подписок', call_command, 'rebuild_timelines',
+                      stdout=self.stdout)
@@ -0,0 +1,35 @@
+import sys
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = 'Загружает выгрузку export_yatube (NDJSON)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', nargs='?', default='-',
+                            help='Файл; по умолчанию stdin')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--skip-derived', action='store_true',
+                            help='Не пересчитывать счётчики и ленты '
+                                 'подписок после загрузки')
+
+    def handle(self, *args, **options):
+        source = sys.stdin
+        if options['input'] != '-':
+            source = open(options['input'], encoding='utf-8')
+        try:
+            counts = transfer.load(source, options['batch_size'])
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        for model, count in counts.items():
+            self.stdout.write(f'{model}: прочитано {count}')
+        if not options['skip_derived']:
+            # bulk_create обходит сигналы, которые ведут эти данные.
+            call_command('recount', batch_size=options['batch_size'],
+                         stdout=self.stdout)
+            call_command('rebuild_timelines', stdout=self.stdout)
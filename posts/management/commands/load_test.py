@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import loadtest
+
+
+class Command(BaseCommand):
+    help = ('Нагружает сайт смесью запросов и печатает RPS, перцентили '
+            'времени ответа и долю ошибок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url',
+                            help='Адрес запущенного сервера; без него '
+                                 'запросы идут в WSGI-приложение напрямую')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--processes', action='store_true',
+                            help='Исполнители — процессы, а не потоки')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Сколько секунд гонять')
+        parser.add_argument('--requests', type=int,
+                            help='Остановиться после стольких запросов')
+        parser.add_argument('--mix',
+                            help='Веса сценариев, например '
+                                 'index=30,post_view=20; по умолчанию '
+                                 + ','.join(f'{name}={weight}' for name, weight
+                                            in loadtest.MIX.items()))
+        parser.add_argument('--password', default=loadtest.PASSWORD,
+                            help='Пароль пользователей для входа')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency должно быть не меньше 1')
+        try:
+            mix = options['mix'] and loadtest.parse_mix(options['mix'])
+            samples, elapsed = loadtest.run(
+                mix, options['concurrency'], options['duration'],
+                options['requests'], options['url'], options['processes'],
+                options['seed'], options['password'])
+        except loadtest.LoadTestError as error:
+            raise CommandError(error)
+
+        self.stdout.write(f'{"сценарий":<14}{"запросов":>9}{"RPS":>9}'
+                          f'{"ошибки":>9}{"p50, мс":>10}{"p95, мс":>10}'
+                          f'{"p99, мс":>10}')
+        for row in loadtest.report(samples, elapsed):
+            self.stdout.write(
+                f'{row["scenario"]:<14}{row["requests"]:>9}'
+                f'{row["rps"]:>9.1f}{row["errors"]:>9.1%}'
+                f'{row["p50"]:>10.1f}{row["p95"]:>10.1f}{row["p99"]:>10.1f}')
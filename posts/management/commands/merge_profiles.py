@@ -0,0 +1,94 @@
+import glob
+import io
+import os
+import pstats
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from yatube.profiling import read_collapsed, write_collapsed
+
+
+class Command(BaseCommand):
+    help = ('Сводит профили ProfilerMiddleware: стеки .collapsed — в один '
+            'файл для flamegraph, .prof — в общую статистику pstats')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=settings.PROFILE_DIR)
+        parser.add_argument('--view', action='append', default=[],
+                            help='Только профили этих view')
+        parser.add_argument('-o', '--output',
+                            help='Куда записать сведённые стеки '
+                                 '(.collapsed) для flamegraph')
+        parser.add_argument('--pstats-output',
+                            help='Куда записать сведённый .prof')
+        parser.add_argument('--limit', type=int, default=20,
+                            help='Сколько функций показать в сводке')
+        parser.add_argument('--sort', default='cumulative',
+                            choices=['cumulative', 'tottime', 'calls'])
+
+    def files(self, directory, suffix, views):
+        found = {}
+        for path in sorted(glob.glob(os.path.join(directory, '*',
+                                                  f'*{suffix}'))):
+            view = os.path.basename(os.path.dirname(path))
+            if not views or view in views:
+                found.setdefault(view, []).append(path)
+        return found
+
+    def handle(self, *args, **options):
+        directory, views = options['dir'], options['view']
+        collapsed = self.files(directory, '.collapsed', views)
+        profiles = self.files(directory, '.prof', views)
+        if not collapsed and not profiles:
+            raise CommandError(f'В {directory} нет профилей')
+        if collapsed:
+            self.merge_collapsed(collapsed, options)
+        if profiles:
+            self.merge_pstats(profiles, options)
+
+    def merge_collapsed(self, found, options):
+        stacks = Counter()
+        for view, paths in found.items():
+            view_stacks = Counter()
+            for path in paths:
+                view_stacks.update(read_collapsed(path))
+            self.stdout.write(f'{view}: профилей {len(paths)}, '
+                              f'снимков стека {sum(view_stacks.values())}')
+            # Имя view — корень стека, чтобы на графе они не смешались.
+            stacks.update({f'{view};{stack}': count
+                           for stack, count in view_stacks.items()})
+        if options['output']:
+            write_collapsed(stacks, options['output'])
+            self.stdout.write(f'Стеки записаны в {options["output"]}')
+
+        total = sum(stacks.values())
+        if not total:
+            return
+        own, inclusive = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')[1:]
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        self.stdout.write('\nСобственное время (доля снимков):')
+        for frame, count in own.most_common(options['limit']):
+            self.stdout.write(f'{count / total:7.1%}  {frame}')
+        self.stdout.write('\nВместе с вызванными:')
+        for frame, count in inclusive.most_common(options['limit']):
+            self.stdout.write(f'{count / total:7.1%}  {frame}')
+
+    def merge_pstats(self, found, options):
+        paths = [path for paths in found.values() for path in paths]
+        for view, view_paths in found.items():
+            self.stdout.write(f'{view}: профилей cProfile {len(view_paths)}')
+        output = io.StringIO()
+        stats = pstats.Stats(*paths, stream=output)
+        if options['pstats_output']:
+            stats.dump_stats(options['pstats_output'])
+            self.stdout.write(f'Статистика записана в '
+                              f'{options["pstats_output"]}')
+        stats.strip_dirs().sort_stats(options['sort'])
+        stats.print_stats(options['limit'])
+        self.stdout.write(output.getvalue())
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+from posts.models import Post, User
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики комментариев, записей и подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def batches(self, queryset, size):
+        last = 0
+        while True:
+            ids = list(queryset.filter(pk__gt=last).order_by('pk')
+                       .values_list('pk', flat=True)[:size])
+            if not ids:
+                return
+            last = ids[-1]
+            yield queryset.filter(pk__gte=ids[0], pk__lte=last)
+
+    def handle(self, *args, **options):
+        size = options['batch_size']
+        for posts in self.batches(Post.objects.all(), size):
+            counters.recount_posts(posts)
+        for users in self.batches(User.objects.all(), size):
+            counters.recount_users(users)
+        self.stdout.write('Счётчики пересчитаны')
@@ -0,0 +1,76 @@
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from posts import transfer
+from posts.models import Comment, Follow
+from yatube.routers import social_database
+
+
+def _rows(model, using, pks):
+    names = [field.attname for field in model._meta.concrete_fields]
+    rows = model._base_manager.using(using).filter(pk__in=pks)
+    return {row[0]: row for row in rows.values_list('pk', *names)}
+
+
+def _delete(model, using, pks):
+    # Без сигналов: строки не удаляются, а переезжают, и счётчики
+    # трогать нельзя.
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    column = connection.ops.quote_name(model._meta.pk.column)
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {column} IN '
+                       f'({placeholders})', list(pks))
+
+
+class Command(BaseCommand):
+    help = ('Переносит комментарии, подписки и сессии из основной базы '
+            'в SOCIAL_DATABASE')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--delete', action='store_true',
+                            help='Удалить из основной базы строки, которые '
+                                 'совпали с перенесёнными')
+
+    def handle(self, *args, **options):
+        target = social_database()
+        if not target:
+            raise CommandError('SOCIAL_DATABASE не задана')
+        size = options['batch_size']
+        conflicts = 0
+        for model in (Comment, Follow, Session):
+            source = model._base_manager.using(DEFAULT_DB_ALIAS)
+            moved, skipped = [], 0
+            for batch in transfer.batches(source.order_by('pk'), size):
+                pks = [obj.pk for obj in batch]
+                with transaction.atomic(using=target):
+                    present = set(model._base_manager.using(target)
+                                  .filter(pk__in=pks)
+                                  .values_list('pk', flat=True))
+                    transfer.bulk_create_dated(
+                        model, [obj for obj in batch
+                                if obj.pk not in present], target)
+                # Удаляем только строки, которые в новой базе совпадают
+                # с исходными: чужая строка с тем же pk остаётся на месте.
+                copies = _rows(model, target, pks)
+                same = [pk for pk, row in _rows(
+                    model, DEFAULT_DB_ALIAS, pks).items()
+                    if copies.get(pk) == row]
+                moved.extend(same)
+                skipped += len(pks) - len(same)
+            if options['delete']:
+                for start in range(0, len(moved), size):
+                    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                        _delete(model, DEFAULT_DB_ALIAS,
+                                moved[start:start + size])
+            conflicts += skipped
+            self.stdout.write(f'{model._meta.label}: перенесено {len(moved)}'
+                              + (f', конфликтов {skipped}' if skipped
+                                 else ''))
+        if conflicts:
+            raise CommandError(
+                f'{conflicts} строк в SOCIAL_DATABASE уже заняты другими '
+                f'данными с теми же pk; они остались в основной базе')
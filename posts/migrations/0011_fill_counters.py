@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count(model, field):
+    counted = (model.objects.filter(**{field: OuterRef('pk')}).order_by()
+               .values(field).annotate(count=Count('pk')).values('count'))
+    return Coalesce(Subquery(counted, output_field=IntegerField()), 0)
+
+
+def fill_counters(apps, schema_editor):
+    alias = schema_editor.connection.alias
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    Follow = apps.get_model('posts', 'Follow')
+    UserStats = apps.get_model('posts', 'UserStats')
+    # Если база создаётся сразу с SOCIAL_DATABASE, таблиц комментариев
+    # и подписок в ней нет, а в новой базе их и считать нечего.
+    tables = schema_editor.connection.introspection.table_names()
+    social = {Comment._meta.db_table, Follow._meta.db_table} <= set(tables)
+
+    if social:
+        Post.objects.using(alias).update(comment_count=count(Comment, 'post'))
+    UserStats.objects.using(alias).bulk_create(
+        [UserStats(user_id=pk)
+         for pk in User.objects.using(alias).values_list('pk', flat=True)],
+        batch_size=500, ignore_conflicts=True)
+    counters = {'posts': count(Post, 'author')}
+    if social:
+        counters.update(followers=count(Follow, 'author'),
+                        following=count(Follow, 'user'))
+    UserStats.objects.using(alias).update(**counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0010_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:47
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# SQLite добавляет столбцы, пересоздавая posts_post, и вместе со старой
+# таблицей удаляет триггеры поискового индекса — создаём их заново.
+fts = import_module('posts.migrations.0012_post_fts')
+restore_fts = fts.run(fts.DROP[:3] + fts.CREATE[1:])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_post_fts'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_fts),
+        migrations.AddField(
+            model_name='post',
+            name='image_bytes',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Размер файла'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_format',
+            field=models.CharField(blank=True, editable=False, max_length=10, verbose_name='Формат'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Высота'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ширина'),
+        ),
+        migrations.RunPython(restore_fts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+import hashlib
+
+from django.core.files.storage import default_storage
+from django.db import migrations
+from PIL import Image
+
+
+def fill_image_metadata(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    posts = (Post.objects.exclude(image='').exclude(image=None)
+             .filter(image_hash='').values_list('pk', 'image'))
+    for pk, name in posts.iterator():
+        digest, size = hashlib.sha256(), 0
+        try:
+            with default_storage.open(name, 'rb') as file:
+                for chunk in file.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+                file.seek(0)
+                with Image.open(file) as image:
+                    (width, height), image_format = image.size, image.format
+        except (OSError, ValueError):
+            # Файла нет или это не картинка — оставляем поля пустыми.
+            continue
+        Post.objects.filter(pk=pk).update(
+            image_width=width, image_height=height,
+            image_format=image_format or '', image_bytes=size,
+            image_hash=digest.hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_image_metadata'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_image_metadata, migrations.RunPython.noop),
+    ]
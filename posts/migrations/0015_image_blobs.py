@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:50
+
+from django.db import migrations, models
+from django.db.models import Count
+import posts.storage
+
+
+def fill_blobs(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    ImageBlob = apps.get_model('posts', 'ImageBlob')
+    counted = (Post.objects.exclude(image='').exclude(image=None).order_by()
+               .values_list('image').annotate(refs=Count('pk')))
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=name, refs=refs) for name, refs in counted.iterator()],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_fill_image_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Файл')),
+                ('refs', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+                ('orphaned', models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Без ссылок с')),
+            ],
+            options={
+                'verbose_name_plural': 'Файлы картинок',
+            },
+        ),
+        # Хранилище не влияет на схему, а перестройка posts_post в SQLite
+        # удалила бы триггеры поиска.
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.AlterField(
+                model_name='post',
+                name='image',
+                field=models.ImageField(blank=True, null=True, storage=posts.storage.ContentAddressedStorage(), upload_to='posts/'),
+            ),
+        ]),
+        migrations.RunPython(fill_blobs, migrations.RunPython.noop),
+    ]
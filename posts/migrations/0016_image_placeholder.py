@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 03:52
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+# Как в 0013: перестройка posts_post в SQLite удаляет триггеры поиска.
+fts = import_module('posts.migrations.0012_post_fts')
+restore_fts = fts.run(fts.DROP[:3] + fts.CREATE[1:])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_image_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_fts),
+        migrations.AddField(
+            model_name='post',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, verbose_name='Заглушка'),
+        ),
+        migrations.RunPython(restore_fts, migrations.RunPython.noop),
+    ]
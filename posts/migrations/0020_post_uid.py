@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 05:00
+
+import uuid
+from importlib import import_module
+
+from django.db import migrations, models
+
+# SQLite пересоздаёт posts_post и теряет триггеры поискового индекса.
+fts = import_module('posts.migrations.0012_post_fts')
+restore_fts = fts.run(fts.DROP[:3] + fts.CREATE[1:])
+
+
+def fill_uids(apps, schema_editor):
+    # AddField вычислил бы uuid4 один раз на все строки — раздаём сами.
+    Post = apps.get_model('posts', 'Post')
+    posts = Post.objects.using(schema_editor.connection.alias)
+    batch = []
+    for pk in posts.filter(uid=None).values_list('pk', flat=True).iterator():
+        batch.append(Post(pk=pk, uid=uuid.uuid4()))
+        if len(batch) == 500:
+            posts.bulk_update(batch, ['uid'])
+            batch = []
+    posts.bulk_update(batch, ['uid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_timeline_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, restore_fts),
+        migrations.AddField(
+            model_name='post',
+            name='uid',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_uids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='post',
+            name='uid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+        migrations.RunPython(restore_fts, migrations.RunPython.noop),
+    ]
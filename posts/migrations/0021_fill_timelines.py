@@ -0,0 +1,61 @@
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connections, migrations, router
+
+BATCH_SIZE = 500
+
+
+def fill_timelines(apps, schema_editor):
+    """Заполняет ленты по подпискам, сделанным до появления TimelineEntry.
+
+    Пересобираются только пустые ленты, поэтому повторный запуск ничего
+    не портит. Посты pull-авторов в ленту не кладутся: Feed читает их
+    при запросе.
+    """
+    alias = schema_editor.connection.alias
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    TimelineEntry = apps.get_model('posts', 'TimelineEntry')
+    UserStats = apps.get_model('posts', 'UserStats')
+    # С SOCIAL_DATABASE подписки живут в своей базе; если её ещё
+    # не создали, подписок нет и раскладывать нечего.
+    follows_alias = router.db_for_read(Follow) or alias
+    if (Follow._meta.db_table
+            not in connections[follows_alias].introspection.table_names()):
+        return
+
+    entries = TimelineEntry.objects.using(alias)
+    built = set(entries.values_list('user', flat=True).distinct())
+    pull = set(UserStats.objects.using(alias).filter(
+        followers__gte=settings.POSTS_FANOUT_MAX_FOLLOWERS,
+    ).values_list('user', flat=True))
+    follows = (Follow.objects.using(follows_alias).order_by('user')
+               .values_list('user', 'author'))
+    batch = []
+    for user, rows in groupby(follows.iterator(), key=lambda row: row[0]):
+        if user in built:
+            continue
+        authors = {author for _, author in rows} - pull
+        posts = (Post.objects.using(alias).filter(author__in=authors)
+                 .order_by('-pub_date').values_list('pk', 'pub_date')
+                 [:settings.POSTS_TIMELINE_LENGTH])
+        batch.extend(TimelineEntry(user_id=user, post_id=pk,
+                                   pub_date=pub_date)
+                     for pk, pub_date in posts)
+        if len(batch) >= BATCH_SIZE:
+            entries.bulk_create(batch, batch_size=BATCH_SIZE,
+                                ignore_conflicts=True)
+            batch = []
+    entries.bulk_create(batch, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0020_post_uid'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
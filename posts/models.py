@@ -1,6 +1,10 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth import get_user_model
 
+from .storage import image_storage
+
 User = get_user_model()
 
 
@@ -16,25 +20,59 @@ class Group(models.Model):
 class Post(models.Model):
     text = models.TextField(verbose_name="Текст")
     pub_date = models.DateTimeField("Дата публикации", auto_now_add=True)
+    # Постоянный идентификатор поста в выгрузках export_yatube.
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name="posts", verbose_name="Автор")
     group = models.ForeignKey(Group, on_delete=models.SET_NULL,
                               blank=True, null=True, related_name="posts",
                               verbose_name="Группа")
-    image = models.ImageField(upload_to='posts/', blank=True, null=True)
+    image = models.ImageField(upload_to='posts/', storage=image_storage,
+                              blank=True, null=True)
+    # Заполняются при загрузке (signals.post_image_changing), чтобы не
+    # открывать оригинал при выводе. width_field/height_field не подходят:
+    # с ними Django читает файл при загрузке поста, если размеры пусты.
+    image_width = models.PositiveIntegerField("Ширина", blank=True,
+                                              null=True, editable=False)
+    image_height = models.PositiveIntegerField("Высота", blank=True,
+                                               null=True, editable=False)
+    image_format = models.CharField("Формат", max_length=10, blank=True,
+                                    editable=False)
+    image_bytes = models.PositiveIntegerField("Размер файла", blank=True,
+                                              null=True, editable=False)
+    image_hash = models.CharField("SHA-256", max_length=64, blank=True,
+                                  editable=False)
+    image_placeholder = models.TextField("Заглушка", blank=True,
+                                         editable=False)
+    comment_count = models.PositiveIntegerField("Комментариев", default=0,
+                                                editable=False)
 
     class Meta:
         ordering = ['-pub_date']
         verbose_name_plural = 'Посты'
+        # Ленты сортируются по ключу пагинации (-pub_date, -id).
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='post_pub_date_id'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='post_author_pub_date'),
+            models.Index(fields=['group', '-pub_date', '-id'],
+                         name='post_group_pub_date'),
+        ]
 
 
 class Comment(models.Model):
+    # Комментарии и подписки могут жить в отдельной базе (yatube.routers),
+    # поэтому их внешние ключи без ограничений в базе, а удаление поста
+    # и пользователя обрабатывают сигналы.
     post = models.ForeignKey(Post,
-                             on_delete=models.SET_NULL,
+                             on_delete=models.DO_NOTHING,
+                             db_constraint=False,
                              related_name="comments", blank=True, null=True,
                              verbose_name="Пост",
                              help_text="Добавьте комментарий к посту")
-    author = models.ForeignKey(User, on_delete=models.CASCADE,
+    author = models.ForeignKey(User, on_delete=models.DO_NOTHING,
+                               db_constraint=False,
                                verbose_name="Автор комментария",
                                related_name="comments",
                                help_text="Автор комментария")
@@ -46,14 +84,18 @@ class Comment(models.Model):
     class Meta:
         ordering = ('created',)
         verbose_name_plural = 'Комментарии'
+        indexes = [models.Index(fields=['post', 'created'],
+                                name='comment_post_created')]
 
 
 class Follow(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE,
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING,
+                             db_constraint=False,
                              related_name="follower",
                              verbose_name='Подписчик',
                              help_text="Подписчик")
-    author = models.ForeignKey(User, on_delete=models.CASCADE,
+    author = models.ForeignKey(User, on_delete=models.DO_NOTHING,
+                               db_constraint=False,
                                related_name="following",
                                verbose_name='Автор',
                                help_text="Автор")
@@ -61,3 +103,45 @@ class Follow(models.Model):
     class Meta:
         db_table = 'posts_follow'
         unique_together = ['user', 'author']
+        # unique_together покрывает подписки пользователя, этот — подписчиков.
+        indexes = [models.Index(fields=['author', 'user'],
+                                name='follow_author_user')]
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name="timeline",
+                             verbose_name='Подписчик')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE,
+                             related_name="timeline_entries",
+                             verbose_name='Пост')
+    pub_date = models.DateTimeField("Дата публикации")
+
+    class Meta:
+        unique_together = ['user', 'post']
+        indexes = [models.Index(fields=['user', '-pub_date', '-post'],
+                                name='timeline_user_pub_date_post')]
+        verbose_name_plural = 'Ленты подписок'
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True, related_name="stats",
+                                verbose_name='Пользователь')
+    posts = models.PositiveIntegerField("Записей", default=0)
+    followers = models.PositiveIntegerField("Подписчиков", default=0)
+    following = models.PositiveIntegerField("Подписок", default=0)
+
+    class Meta:
+        verbose_name_plural = 'Счётчики пользователей'
+
+
+class ImageBlob(models.Model):
+    """Файл картинки в хранилище и число постов, которые на него ссылаются."""
+    name = models.CharField("Файл", max_length=100, primary_key=True)
+    refs = models.PositiveIntegerField("Ссылок", default=0)
+    orphaned = models.DateTimeField("Без ссылок с", blank=True, null=True,
+                                    db_index=True)
+
+    class Meta:
+        verbose_name_plural = 'Файлы картинок'
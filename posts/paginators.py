@@ -0,0 +1,208 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from django.core.paginator import Page, Paginator
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+PER_PAGE = 10
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class Cursor(namedtuple('Cursor', ['pub_date', 'pk'])):
+    """Позиция в ленте: (pub_date, id) крайнего поста страницы."""
+
+    @classmethod
+    def from_post(cls, post):
+        return cls(post.pub_date, post.pk)
+
+    @classmethod
+    def decode(cls, value):
+        try:
+            micro, pk = value.split('_')
+            return cls(EPOCH + timedelta(microseconds=int(micro)), int(pk))
+        except (AttributeError, ValueError, OverflowError):
+            return None
+
+    def encode(self):
+        micro = (self.pub_date - EPOCH) // timedelta(microseconds=1)
+        return f'{micro}_{self.pk}'
+
+    def older(self, date='pub_date', pk='pk'):
+        return (Q(**{f'{date}__lt': self.pub_date})
+                | Q(**{date: self.pub_date, f'{pk}__lt': self.pk}))
+
+    def newer(self, date='pub_date', pk='pk'):
+        return (Q(**{f'{date}__gt': self.pub_date})
+                | Q(**{date: self.pub_date, f'{pk}__gt': self.pk}))
+
+
+class Keyset:
+    """Queryset, который режется по ключу (pub_date, pk).
+
+    paginate принимает и другие ленты с теми же методами — например,
+    timeline.Feed, которая сливает несколько таких источников.
+    """
+
+    def __init__(self, queryset, date='pub_date', pk='pk'):
+        self.queryset = queryset
+        self.date = date
+        self.pk = pk
+
+    def older(self, cursor, limit, offset=0):
+        rows = self.queryset.order_by(f'-{self.date}', f'-{self.pk}')
+        if cursor is not None:
+            rows = rows.filter(cursor.older(self.date, self.pk))
+        return list(rows[offset:offset + limit])
+
+    def newer(self, cursor, limit):
+        return list(self.queryset.filter(cursor.newer(self.date, self.pk))
+                    .order_by(self.date, self.pk)[:limit])
+
+    def keys_older(self, cursor, limit):
+        rows = (self.queryset.filter(cursor.older(self.date, self.pk))
+                .order_by(f'-{self.date}', f'-{self.pk}')
+                .values_list(self.date, self.pk)[:limit])
+        return [Cursor(*row) for row in rows]
+
+    def keys_newer(self, cursor, limit):
+        rows = (self.queryset.filter(cursor.newer(self.date, self.pk))
+                .order_by(self.date, self.pk)
+                .values_list(self.date, self.pk)[:limit])
+        return [Cursor(*row) for row in rows]
+
+    def count(self):
+        return self.queryset.count()
+
+
+class Navigation:
+    """Ссылки «новее/старее» и, по желанию, окно номеров страниц.
+
+    pages — номера страниц окна с курсорами, от которых они начинаются:
+    {номер: {'after' или 'before': Cursor}}; у первой страницы курсора нет.
+    """
+
+    def __init__(self, params, number, first=None, last=None,
+                 has_newer=False, has_older=False, pages=None):
+        self.params = params
+        self.number = number
+        self.has_newer = has_newer and first is not None
+        self.has_older = has_older and last is not None
+        self.first = first
+        self.last = last
+        self.pages = pages or {}
+
+    @property
+    def page_range(self):
+        return sorted(self.pages)
+
+    @property
+    def has_other_pages(self):
+        return self.has_newer or self.has_older or len(self.pages) > 1
+
+    def _query(self, **values):
+        query = self.params.copy()
+        for key in ('page', 'after', 'before'):
+            query.pop(key, None)
+        query.update(values)
+        return query.urlencode()
+
+    @property
+    def newer_query(self):
+        if self.number <= 2:
+            return self._query()
+        return self._query(before=self.first.encode(), page=self.number - 1)
+
+    @property
+    def older_query(self):
+        return self._query(after=self.last.encode(), page=self.number + 1)
+
+    @property
+    def page_links(self):
+        links = []
+        for i in self.page_range:
+            cursors = {key: cursor.encode()
+                       for key, cursor in self.pages[i].items()}
+            links.append((i, self._query(**cursors, page=i) if cursors
+                          else self._query()))
+        return links
+
+
+def page_number(value):
+    try:
+        return max(int(value), 1)
+    except (TypeError, ValueError):
+        return 1
+
+
+def _window(feed, number, first, last, per_page, window, has_newer,
+            has_older):
+    """Курсоры страниц окна: по одному запросу ключей в каждую сторону.
+
+    Страница number + k начинается после (k - 1) * per_page постов,
+    которые старее last, страница number - k — с такого же числа
+    постов новее first.
+    """
+    pages = {number: {}}
+    limit = per_page * (window - 1) + 1
+    if has_older:
+        pages[number + 1] = {'after': last}
+        keys = feed.keys_older(last, limit) if window > 1 else []
+        for k in range(2, window + 1):
+            if len(keys) <= (k - 1) * per_page:
+                break
+            pages[number + k] = {'after': keys[(k - 1) * per_page - 1]}
+    if has_newer:
+        keys = (feed.keys_newer(first, limit) if window > 1 and number > 2
+                else [])
+        for k in range(1, min(window, number - 1) + 1):
+            if number - k == 1:
+                pages[1] = {}
+            elif k == 1:
+                pages[number - 1] = {'before': first}
+            elif len(keys) > (k - 1) * per_page:
+                pages[number - k] = {'before': keys[(k - 1) * per_page - 1]}
+            else:
+                break
+    return pages
+
+
+def paginate(request, queryset, per_page=PER_PAGE, window=0):
+    """Режет ленту по ключу (pub_date, id) без COUNT и OFFSET.
+
+    queryset — QuerySet или лента с методами Keyset. Возвращает обычные
+    Paginator и Page (COUNT выполнится, только если шаблон обратится
+    к paginator.count) и Navigation для ссылок. Все ссылки, включая
+    окно из window номеров в каждую сторону, несут курсор, а номер
+    страницы в них только для отображения; ?page=N без курсора
+    (например, набранный вручную) работает через OFFSET.
+    """
+    paginator = Paginator(queryset, per_page)
+    feed = Keyset(queryset) if isinstance(queryset, QuerySet) else queryset
+    params = request.GET
+    number = page_number(params.get('page'))
+    after = Cursor.decode(params.get('after'))
+    before = Cursor.decode(params.get('before'))
+
+    if after is not None:
+        rows = feed.older(after, per_page + 1)
+        objects = rows[:per_page]
+        has_newer, has_older = True, len(rows) > per_page
+    elif before is not None:
+        rows = feed.newer(before, per_page + 1)
+        objects = rows[:per_page][::-1]
+        has_newer, has_older = len(rows) > per_page, True
+    else:
+        rows = feed.older(None, per_page + 1, offset=(number - 1) * per_page)
+        objects = rows[:per_page]
+        has_newer, has_older = number > 1, len(rows) > per_page
+
+    first = Cursor.from_post(objects[0]) if objects else None
+    last = Cursor.from_post(objects[-1]) if objects else None
+    pages = None
+    if window and objects:
+        pages = _window(feed, number, first, last, per_page, window,
+                        has_newer, has_older)
+    nav = Navigation(params, number, first, last, has_newer, has_older,
+                     pages)
+    return paginator, Page(objects, number, paginator), nav
@@ -0,0 +1,135 @@
+"""Полнотекстовый поиск по Post.text через SQLite FTS5.
+
+Индекс posts_post_fts — внешняя content-таблица над posts_post, его
+поддерживают триггеры из миграции 0012_post_fts, так что он обновляется
+при любом сохранении и удалении поста, включая bulk_create.
+Результаты упорядочены по bm25 и листаются курсором (rank, id).
+"""
+import re
+from collections import namedtuple
+
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from . import feeds
+from .models import Post
+
+TABLE = 'posts_post_fts'
+PER_PAGE = 10
+# Служебные символы вместо <mark>: текст поста сначала экранируется.
+MARK_START, MARK_END = '\x02', '\x03'
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+class RankCursor(namedtuple('RankCursor', ['rank', 'pk'])):
+
+    @classmethod
+    def decode(cls, value):
+        try:
+            rank, pk = value.rsplit('_', 1)
+            return cls(float(rank), int(pk))
+        except (AttributeError, ValueError):
+            return None
+
+    def encode(self):
+        return f'{self.rank!r}_{self.pk}'
+
+
+def to_match(query):
+    """Превращает ввод пользователя в безопасное выражение MATCH."""
+    words = WORD.findall(query or '')
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def available():
+    return connection.vendor == 'sqlite'
+
+
+def matching(query):
+    """Подзапрос id постов, подходящих под запрос, — для фильтров."""
+    return RawSQL(f'SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s',
+                  [to_match(query)])
+
+
+def _highlight(snippet):
+    html = escape(snippet)
+    return mark_safe(html.replace(MARK_START, '<mark>')
+                     .replace(MARK_END, '</mark>'))
+
+
+def _ranked(match, after=None, before=None, limit=PER_PAGE + 1):
+    sql = (f'SELECT rowid, bm25({TABLE}) AS score, '
+           f"snippet({TABLE}, 0, %s, %s, '…', 24) "
+           f'FROM {TABLE} WHERE {TABLE} MATCH %s')
+    params = [MARK_START, MARK_END, match]
+    order = 'score, rowid'
+    if after is not None:
+        sql += ' AND (score > %s OR (score = %s AND rowid > %s))'
+        params += [after.rank, after.rank, after.pk]
+    elif before is not None:
+        sql += ' AND (score < %s OR (score = %s AND rowid < %s))'
+        params += [before.rank, before.rank, before.pk]
+        order = 'score DESC, rowid DESC'
+    sql += f' ORDER BY {order} LIMIT %s'
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return rows[::-1] if before is not None else rows
+
+
+def search(query, after=None, before=None, per_page=PER_PAGE):
+    """Страница результатов: (посты, есть_раньше, есть_дальше).
+
+    У каждого поста есть атрибуты rank и snippet с подсвеченными словами.
+    """
+    match = to_match(query)
+    if not match:
+        return [], False, False
+    if not available():
+        posts = list(feeds.cards(Post.objects.filter(text__icontains=query))
+                     [:per_page])
+        for post in posts:
+            post.rank, post.snippet = 0.0, post.text
+        return posts, False, False
+
+    rows = _ranked(match, after, before, per_page + 1)
+    has_more = len(rows) > per_page
+    if before is not None:
+        rows = rows[-per_page:]
+    else:
+        rows = rows[:per_page]
+    found = feeds.cards(Post.objects.all()).in_bulk([row[0] for row in rows])
+    posts = []
+    for pk, rank, snippet in rows:
+        post = found.get(pk)
+        if post is not None:
+            post.rank, post.snippet = rank, _highlight(snippet)
+            posts.append(post)
+    if before is not None:
+        return posts, has_more, True
+    return posts, after is not None, has_more
+
+
+def reindex(batch_size=1000):
+    """Перестраивает индекс, читая посты пачками по первичному ключу.
+
+    Всё идёт одной транзакцией: поиск до конца пересборки видит
+    старый индекс, а упавшая пересборка не оставляет его пустым.
+    """
+    if not available():
+        return 0
+    count, last = 0, 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('delete-all')")
+        while True:
+            batch = list(Post.objects.filter(pk__gt=last).order_by('pk')
+                         .values_list('pk', 'text')[:batch_size])
+            if not batch:
+                return count
+            cursor.executemany(
+                f'INSERT INTO {TABLE}(rowid, text) VALUES (%s, %s)', batch)
+            count += len(batch)
+            last = batch[-1][0]
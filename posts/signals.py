@@ -0,0 +1,110 @@
+from django.db.models import Q
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import blobs, caching, counters, feeds, timeline, uploads
+from .models import Comment, Follow, Group, Post, User, UserStats
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    # Комментарии и подписки могут быть в другой базе, каскад Django
+    # до них не дойдёт.
+    Comment.objects.filter(author=instance).delete()
+    Follow.objects.filter(Q(user=instance) | Q(author=instance)).delete()
+
+
+@receiver(pre_save, sender=Post)
+def post_changing(sender, instance, raw, **kwargs):
+    # Пост могли перенести в другую группу: старая лента тоже устарела.
+    if instance.pk is not None and not raw:
+        old_groups = Group.objects.filter(posts=instance.pk)
+        caching.bump(*(caching.group_scope(slug) for slug
+                       in old_groups.values_list('slug', flat=True)))
+
+
+@receiver(pre_save, sender=Post)
+def post_image_changing(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    image = instance.image
+    if not image:
+        instance.image_width = instance.image_height = None
+        instance.image_bytes = None
+        instance.image_format = instance.image_hash = ''
+        instance.image_placeholder = ''
+    elif not image._committed:
+        # Новый файл ещё в памяти или во временном файле загрузки.
+        for field, value in uploads.describe(image.file).items():
+            setattr(instance, field, value)
+        # Заглушку для нового файла подготовит thumbnails.generate.
+        instance.image_placeholder = ''
+    # Прежний файл нужен post_saved, чтобы снять с него ссылку.
+    instance._old_image = ''
+    if instance.pk is not None:
+        instance._old_image = Post.objects.filter(pk=instance.pk).values_list(
+            'image', flat=True).first() or ''
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    caching.bump(*caching.scopes_for(instance))
+    old_image = getattr(instance, '_old_image', '')
+    if (instance.image.name or '') != old_image:
+        blobs.attach(instance.image.name)
+        blobs.release(old_image)
+    if created:
+        counters.post_added(instance)
+        timeline.fan_out(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    Comment.objects.filter(post=instance).update(post=None)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    counters.post_deleted(instance)
+    blobs.release(instance.image.name)
+    caching.bump(*caching.scopes_for(instance))
+
+
+@receiver(post_save, sender=Comment)
+def comment_created(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        counters.comment_added(instance)
+        if instance.post_id is not None:
+            caching.bump(*caching.scopes_for(instance.post))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    counters.comment_deleted(instance)
+    # При каскадном удалении пост мог уйти из базы раньше комментария.
+    post = (feeds.cards(Post.objects.filter(pk=instance.post_id)).first()
+            if instance.post_id is not None else None)
+    if post is not None:
+        caching.bump(*caching.scopes_for(post))
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        counters.follow_added(instance)
+        timeline.backfill(instance.user, instance.author)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.follow_deleted(instance)
+    timeline.remove(instance.user, instance.author)
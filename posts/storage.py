@@ -0,0 +1,71 @@
+"""Хранилище картинок постов с адресацией по содержимому.
+
+Файл называется по SHA-256 содержимого (posts/ab/abcd….jpg), поэтому
+одинаковые загрузки хранятся один раз и делят одни и те же миниатюры.
+Сколько постов ссылается на файл, считает ImageBlob (см. blobs.py);
+файлы без ссылок удаляет команда collect_images.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def content_hash(content):
+    # uploads.describe уже посчитал хэш этого файла в pre_save.
+    digest = getattr(content, 'content_hash', None)
+    if digest is not None:
+        return digest
+    sha = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        sha.update(chunk)
+    content.seek(0)
+    return sha.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def content_name(self, name, content):
+        digest = content_hash(content)
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        return self._save(name, content)
+
+    def _save(self, name, content):
+        # Пишем во временный файл и атомарно переименовываем: две
+        # одновременные загрузки одного содержимого дадут один файл.
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as output:
+                for chunk in content.chunks():
+                    output.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp_path, self.file_permissions_mode)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+
+image_storage = ContentAddressedStorage()
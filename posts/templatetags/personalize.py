@@ -0,0 +1,66 @@
+"""Пользовательские части внутри общего кэшированного HTML.
+
+Карточки постов кэшируются одинаковыми для всех, поэтому вместо ссылки
+«Редактировать» в них стоит метка {% edit_link %}, а вместо имени
+пользователя — {% user_name %}. Блок {% personalize %} после рендера
+заменяет метки для текущего пользователя. Если у запроса выставлен
+defer_personalization, метки остаются в HTML: так страницу целиком
+кэширует caching.cache_feed и заполняет fill() на каждый запрос.
+"""
+import re
+
+from django import template
+from django.urls import reverse
+from django.utils.html import conditional_escape, format_html
+from django.utils.safestring import mark_safe
+
+register = template.Library()
+
+EDIT_MARKER = re.compile(r'<!--edit-link:(\d+):(\d+)-->')
+USER_MARKER = '<!--user-name-->'
+
+
+@register.simple_tag
+def edit_link(post):
+    return mark_safe(f'<!--edit-link:{post.author_id}:{post.pk}-->')
+
+
+@register.simple_tag
+def user_name():
+    return mark_safe(USER_MARKER)
+
+
+def fill(html, user):
+    if user is None or not user.is_authenticated:
+        return EDIT_MARKER.sub('', html).replace(USER_MARKER, '')
+
+    def replace(match):
+        author_id, post_id = match.groups()
+        if int(author_id) != user.pk:
+            return ''
+        return format_html(
+            '<a class="btn btn-sm text-muted" href="{}" role="button">'
+            'Редактировать</a>',
+            reverse('post_edit', args=(user.username, post_id)))
+
+    html = EDIT_MARKER.sub(replace, html)
+    return html.replace(USER_MARKER, conditional_escape(user.username))
+
+
+class PersonalizeNode(template.Node):
+
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        html = self.nodelist.render(context)
+        if getattr(context.get('request'), 'defer_personalization', False):
+            return html
+        return fill(html, context.get('user'))
+
+
+@register.tag
+def personalize(parser, token):
+    nodelist = parser.parse(('endpersonalize',))
+    parser.delete_first_token()
+    return PersonalizeNode(nodelist)
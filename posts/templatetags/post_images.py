@@ -0,0 +1,39 @@
+from django import template
+
+from posts import caching, thumbnails
+
+register = template.Library()
+
+
+def _lookup(post, size):
+    batch = getattr(post, 'thumbnail_batch', None)
+    if batch is not None:
+        return batch.get(post, size)
+    return thumbnails.ready(post.image, size)
+
+
+@register.simple_tag
+def post_thumbnail(post, size='card'):
+    """Готовая миниатюра картинки поста; если её нет — ставит в очередь."""
+    thumbnail = _lookup(post, size)
+    if thumbnail is None and post.image:
+        thumbnails.queue(post.image, caching.scopes_for(post))
+    return thumbnail
+
+
+@register.simple_tag
+def post_picture(post, size='card'):
+    """Варианты картинки для srcset; недостающие ставит в очередь."""
+    if not post.image:
+        return None
+    found = {}
+
+    def lookup(item, name):
+        found[name] = _lookup(item, name)
+        return found[name]
+
+    picture = thumbnails.picture(post, size, lookup)
+    if (picture is None or not all(found.values())
+            or not post.image_placeholder):
+        thumbnails.queue(post.image, caching.scopes_for(post))
+    return picture
@@ -1,12 +1,41 @@
+import hashlib
 import io
+import json
+import os
+import re
+import subprocess
+import sys
 import tempfile
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from importlib import import_module
+from types import SimpleNamespace
 from unittest import mock
 from django.core.files import File
 from PIL import Image
+from django.apps import apps
 from django.contrib.auth.models import User
+from django.conf import settings
+from django.contrib.sessions.models import Session
 from django.core.files.base import ContentFile
-from django.test import TestCase, Client, override_settings
-from posts.models import Post, Group, Follow
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Sum
+from django.utils import timezone
+from posts.models import (Comment, Follow, Group, ImageBlob, Post,
+                          TimelineEntry, UserStats)
+from posts import (benchmarks, blobs, caching, loadtest, thumbnails,
+                   timeline, transfer, uploads)
+from posts.paginators import paginate
+from yatube import metrics, middleware, profiling, routers, sqlite
+from yatube.cache import TwoTierCache
+from django.http import HttpResponse
 from django.urls import reverse
 from django.core.cache import cache
 
@@ -192,12 +221,34 @@ class ImageSubscribeCommentCacheTest(TestCase):
             data={"text": "cache check", "group": self.group.id}, follow=True)
         response = self.auth_client.get(reverse('index'))
         self.assertContains(response, "cache check")
+        Post.objects.filter(text="cache check").update(text="changed")
+        response = self.auth_client.get(reverse('index'))
+        self.assertContains(response, "cache check")
         self.auth_client.post(
             reverse('new_post'),
             data={"text": "2nd cache check",
                   "group": self.group.id}, follow=True)
         response = self.auth_client.get(reverse('index'))
-        self.assertNotContains(response, "2nd cache check")
+        self.assertContains(response, "2nd cache check")
+        self.assertContains(response, "changed")
+
+    def test_cache_comment_invalidates_feeds(self):
+        post = self.create_post(text='This is test post', group=self.group,
+                                author=self.auth_user)
+        urls = (reverse('index'),
+                reverse('group', kwargs={'slug': self.group.slug}),
+                reverse('profile', kwargs={'username': self.NAME}))
+        for url in urls:
+            self.assertContains(self.auth_client.get(url),
+                                'Добавить комментарий')
+        self.auth_client.post(
+            reverse('add_comment',
+                    kwargs={'username': self.NAME, 'post_id': post.id}),
+            data={'text': 'Test comment'})
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(self.auth_client.get(url),
+                                    '1 комментариев')
 
     def test_auth_user_subscribe(self):
         before_subscribe = Follow.objects.count()
@@ -244,3 +295,1401 @@ class ImageSubscribeCommentCacheTest(TestCase):
                                                 kwargs={'username': self.NAME,
                                                         'post_id': post.id}))
         self.assertContains(response, "Test comment")
+
+
+class KeysetPaginatorTest(TestCase):
+    NAME = 'AuthTestUser'
+
+    def setUp(self):
+        self.client = Client()
+        self.auth_user = User.objects.create_user(username=self.NAME)
+        self.group = Group.objects.create(
+            title='This is test group',
+            slug='test_group',
+            description='Some description'
+        )
+        self.posts = [
+            Post.objects.create(text=f'Post {i}', group=self.group,
+                                author=self.auth_user)
+            for i in range(25)
+        ]
+        self.url = reverse('group', kwargs={'slug': self.group.slug})
+
+    def test_older_and_newer_links(self):
+        response = self.client.get(self.url)
+        nav = response.context['nav']
+        self.assertEqual(list(response.context['page']),
+                         self.posts[::-1][:10])
+        self.assertFalse(nav.has_newer)
+        self.assertTrue(nav.has_older)
+
+        response = self.client.get(f'{self.url}?{nav.older_query}')
+        nav = response.context['nav']
+        self.assertEqual(list(response.context['page']),
+                         self.posts[::-1][10:20])
+        self.assertEqual(nav.number, 2)
+
+        response = self.client.get(f'{self.url}?{nav.older_query}')
+        nav = response.context['nav']
+        self.assertEqual(list(response.context['page']),
+                         self.posts[::-1][20:])
+        self.assertFalse(nav.has_older)
+
+        response = self.client.get(f'{self.url}?{nav.newer_query}')
+        self.assertEqual(list(response.context['page']),
+                         self.posts[::-1][10:20])
+
+    def test_no_count_query(self):
+        response = self.client.get(self.url)
+        older_query = response.context['nav'].older_query
+        for query in ('', older_query):
+            with CaptureQueriesContext(connection) as context:
+                self.client.get(f'{self.url}?{query}')
+            with self.subTest(query=query):
+                self.assertFalse(
+                    [q for q in context.captured_queries
+                     if 'COUNT(' in q['sql']])
+
+    def test_page_window(self):
+        request = RequestFactory().get('/', {'page': 2})
+        _, page, nav = paginate(request, Post.objects.all(), window=1)
+        self.assertEqual(list(page), self.posts[::-1][10:20])
+        self.assertEqual(list(nav.page_range), [1, 2, 3])
+
+    def test_page_window_links_carry_cursors(self):
+        newest = self.posts[::-1]
+        request = RequestFactory().get('/', {'page': 3})
+        _, _, nav = paginate(request, Post.objects.all(), per_page=5,
+                             window=2)
+        self.assertEqual(nav.page_range, [1, 2, 3, 4, 5])
+        for i, query in nav.page_links:
+            if i == nav.number:
+                continue
+            with self.subTest(page=i):
+                self.assertEqual('page' in query, i > 1)
+                self.assertEqual(
+                    'after' in query or 'before' in query, i > 1)
+                request = RequestFactory().get(f'/?{query}')
+                _, page, _ = paginate(request, Post.objects.all(),
+                                      per_page=5)
+                self.assertEqual(list(page),
+                                 newest[(i - 1) * 5:i * 5])
+
+
+class TimelineTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='Author')
+        self.follower = User.objects.create_user(username='Follower')
+        self.follower_client = Client()
+        self.follower_client.force_login(self.follower)
+
+    def follow_page(self):
+        response = self.follower_client.get(reverse('follow_index'))
+        return [post.text for post in response.context['page']]
+
+    def test_fan_out_and_unfollow(self):
+        Post.objects.create(text='Before follow', author=self.author)
+        self.follower_client.get(
+            reverse('profile_follow', kwargs={'username': 'Author'}))
+        Post.objects.create(text='After follow', author=self.author)
+        self.assertEqual(TimelineEntry.objects.filter(
+            user=self.follower).count(), 2)
+        self.assertEqual(self.follow_page(), ['After follow', 'Before follow'])
+
+        self.follower_client.get(
+            reverse('profile_unfollow', kwargs={'username': 'Author'}))
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.follow_page(), [])
+
+    @override_settings(POSTS_FANOUT_MAX_FOLLOWERS=1)
+    def test_pull_author(self):
+        Follow.objects.create(user=self.follower, author=self.author)
+        Post.objects.create(text='Pulled', author=self.author)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.follow_page(), ['Pulled'])
+
+    @override_settings(POSTS_TIMELINE_LENGTH=3)
+    def test_trim(self):
+        for i in range(5):
+            Post.objects.create(text=f'Post {i}', author=self.author)
+        Follow.objects.create(user=self.follower, author=self.author)
+        self.assertEqual(self.follow_page(), ['Post 4', 'Post 3', 'Post 2'])
+
+    @override_settings(POSTS_TIMELINE_LENGTH=3)
+    def test_trim_every_nth_post_of_author(self):
+        Follow.objects.create(user=self.follower, author=self.author)
+        for i in range(timeline.TRIM_EVERY * 2):
+            Post.objects.create(text=f'Post {i}', author=self.author)
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.follower).count(), 3)
+
+    def test_pull_authors_merged_by_keyset(self):
+        pulled = User.objects.create_user(username='Pulled')
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=self.follower, author=pulled)
+        Post.objects.create(text='Fanned out', author=pulled)
+        with override_settings(POSTS_FANOUT_MAX_FOLLOWERS=1):
+            for i in range(12):
+                Post.objects.create(text=f'Post {i}',
+                                    author=pulled if i % 2 else self.author)
+            texts = ['Post 11', 'Post 10', 'Post 9', 'Post 8', 'Post 7',
+                     'Post 6', 'Post 5', 'Post 4', 'Post 3', 'Post 2']
+            response = self.follower_client.get(reverse('follow_index'))
+            self.assertEqual(
+                [post.text for post in response.context['page']], texts)
+            older = response.context['nav'].older_query
+            response = self.follower_client.get(
+                f"{reverse('follow_index')}?{older}")
+            self.assertEqual(
+                [post.text for post in response.context['page']],
+                ['Post 1', 'Post 0', 'Fanned out'])
+            # Окно номеров на слитой ленте тоже ведёт по курсорам.
+            feed = timeline.Feed(self.follower)
+            request = RequestFactory().get('/', {'page': 2})
+            _, _, nav = paginate(request, feed, per_page=4, window=2)
+            request = RequestFactory().get(f'/?{dict(nav.page_links)[4]}')
+            _, page, _ = paginate(request, feed, per_page=4)
+            self.assertEqual([post.text for post in page], ['Fanned out'])
+
+    def test_fill_timelines_migration(self):
+        migration = import_module('posts.migrations.0021_fill_timelines')
+        pulled = User.objects.create_user(username='Pulled')
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=self.follower, author=pulled)
+        Post.objects.create(text='Own', author=self.author)
+        Post.objects.create(text='Pulled', author=pulled)
+        TimelineEntry.objects.all().delete()
+        with override_settings(POSTS_FANOUT_MAX_FOLLOWERS=1):
+            UserStats.objects.filter(user=self.author).update(followers=0)
+            migration.fill_timelines(
+                apps, SimpleNamespace(connection=connection))
+            self.assertEqual(list(TimelineEntry.objects.values_list(
+                'post__text', flat=True)), ['Own'])
+            self.assertEqual(self.follow_page(), ['Pulled', 'Own'])
+            # Непустые ленты повторный запуск не трогает.
+            migration.fill_timelines(
+                apps, SimpleNamespace(connection=connection))
+            self.assertEqual(TimelineEntry.objects.count(), 1)
+
+
+class FeedQueriesTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='Author')
+        self.client = Client()
+        self.client.force_login(self.author)
+        self.group = Group.objects.create(
+            title='This is test group',
+            slug='test_group',
+            description='Some description'
+        )
+        Follow.objects.create(
+            user=self.author,
+            author=User.objects.create_user(username='Followed'))
+
+    def add_posts(self, count):
+        for author in (self.author, User.objects.get(username='Followed')):
+            for i in range(count):
+                post = Post.objects.create(text=f'Post {i}',
+                                           group=self.group, author=author)
+                Comment.objects.create(post=post, author=author,
+                                       text='Comment')
+
+    def count_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_constant_queries(self):
+        urls = (reverse('index'),
+                reverse('group', kwargs={'slug': self.group.slug}),
+                reverse('profile', kwargs={'username': 'Author'}),
+                reverse('follow_index'))
+        self.add_posts(2)
+        small = [self.count_queries(url) for url in urls]
+        self.add_posts(10)
+        for url, expected in zip(urls, small):
+            with self.subTest(url=url):
+                self.assertEqual(self.count_queries(url), expected)
+
+
+class CountersTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='Author')
+        self.follower = User.objects.create_user(username='Follower')
+        self.client = Client()
+        self.client.force_login(self.follower)
+
+    def stats(self, user):
+        stats = UserStats.objects.get(user=user)
+        return stats.posts, stats.followers, stats.following
+
+    def test_counters_follow_writes(self):
+        post = Post.objects.create(text='Post', author=self.author)
+        self.client.post(
+            reverse('add_comment', kwargs={'username': 'Author',
+                                           'post_id': post.id}),
+            data={'text': 'Comment'})
+        self.client.get(
+            reverse('profile_follow', kwargs={'username': 'Author'}))
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(self.stats(self.author), (1, 1, 0))
+        self.assertEqual(self.stats(self.follower), (0, 0, 1))
+
+        self.client.get(
+            reverse('profile_unfollow', kwargs={'username': 'Author'}))
+        post.comments.all().delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+        self.assertEqual(self.stats(self.follower), (0, 0, 0))
+        post.delete()
+        self.assertEqual(self.stats(self.author), (0, 0, 0))
+
+    def test_recount(self):
+        post = Post.objects.create(text='Post', author=self.author)
+        Comment.objects.create(post=post, author=self.author, text='Comment')
+        Post.objects.update(comment_count=7)
+        UserStats.objects.all().delete()
+        call_command('recount', batch_size=1, stdout=io.StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(self.stats(self.author), (1, 0, 0))
+
+
+class PersonalizedCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='Author')
+        self.other = User.objects.create_user(username='Other')
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.other_client = Client()
+        self.other_client.force_login(self.other)
+        self.post = Post.objects.create(text='Post', author=self.author)
+        self.edit_url = reverse('post_edit', kwargs={
+            'username': 'Author', 'post_id': self.post.id})
+
+    def test_edit_link_only_for_author(self):
+        for url in (reverse('index'),
+                    reverse('profile', kwargs={'username': 'Author'})):
+            with self.subTest(url=url):
+                self.assertContains(self.author_client.get(url),
+                                    self.edit_url)
+                response = self.other_client.get(url)
+                self.assertNotContains(response, self.edit_url)
+                self.assertContains(response, 'Пользователь: Other')
+                self.assertNotContains(Client().get(url), self.edit_url)
+
+    def test_anonymous_page_cache(self):
+        anonymous = Client()
+        self.assertIsNotNone(anonymous.get(reverse('index')).context)
+        self.assertIsNone(anonymous.get(reverse('index')).context)
+        response = self.author_client.get(reverse('index'))
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, 'Пользователь: Author')
+
+    def test_member_page_cache(self):
+        self.assertIsNotNone(self.author_client.get(reverse('index')).context)
+        with CaptureQueriesContext(connection) as context:
+            response = self.other_client.get(reverse('index'))
+        self.assertIsNone(response.context)
+        self.assertFalse([query for query in context.captured_queries
+                          if 'posts_post' in query['sql']])
+        self.assertContains(response, 'Пользователь: Other')
+        self.assertNotContains(response, self.edit_url)
+        self.assertNotContains(response, '<!--edit-link')
+        response = self.author_client.get(reverse('index'))
+        self.assertIsNone(response.context)
+        self.assertContains(response, self.edit_url)
+
+        Post.objects.create(text='Новый пост', author=self.other)
+        response = self.other_client.get(reverse('index'))
+        self.assertIsNotNone(response.context)
+        self.assertContains(response, 'Новый пост')
+
+
+class TwoTierCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def make_cache(self, **options):
+        options.setdefault('SINGLE_FLIGHT', ['page.'])
+        options.setdefault('LOCK_WAIT', 1)
+        options.setdefault('POLL_INTERVAL', 0.01)
+        return TwoTierCache(self.directory.name, {'OPTIONS': options})
+
+    def test_local_tier(self):
+        first = self.make_cache(LOCAL_MAX_ENTRIES=2, LOCAL_SKIP=['shared.'])
+        second = self.make_cache()
+        for key in ('a', 'b', 'c', 'shared.d'):
+            first.set(key, key)
+        first.shared.clear()
+        self.assertIsNone(first.get('a'))
+        self.assertEqual(first.get('c'), 'c')
+        self.assertIsNone(first.get('shared.d'))
+        second.set('a', 1)
+        self.assertEqual(first.get('a'), 1)
+
+    def test_local_tier_returns_copies(self):
+        cache = self.make_cache()
+        value = {'headers': []}
+        cache.set('a', value)
+        value['headers'].append('X-Set')
+        cache.get('a')['headers'].append('X-Got')
+        self.assertEqual(cache.get('a'), {'headers': []})
+
+    def test_single_flight(self):
+        first, second = self.make_cache(), self.make_cache()
+        self.assertIsNone(first.get('page.index'))
+        timer = threading.Timer(0.1, first.set, ('page.index', 'html'))
+        timer.start()
+        self.assertEqual(second.get('page.index'), 'html')
+        timer.join()
+        self.assertFalse(os.listdir(os.path.join(self.directory.name,
+                                                 'locks')))
+
+    def test_early_refresh(self):
+        first = self.make_cache(LOCAL_TIMEOUT=0, EARLY_REFRESH_BETA=10 ** 9)
+        second = self.make_cache(LOCAL_TIMEOUT=0, EARLY_REFRESH_BETA=10 ** 9)
+        self.assertIsNone(first.get('page.index'))
+        time.sleep(0.01)
+        first.set('page.index', 'old', timeout=60)
+        self.assertIsNone(first.get('page.index'))
+        # Пока первый пересчитывает, остальные получают старое значение.
+        self.assertEqual(second.get('page.index'), 'old')
+        self.assertEqual(second.get('page.index'), 'old')
+
+    def test_concurrent_incr(self):
+        self.make_cache().set('generation', 0, None)
+
+        def bump():
+            cache = self.make_cache()
+            for _ in range(50):
+                cache.incr('generation')
+
+        threads = [threading.Thread(target=bump) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.make_cache().get('generation'), 200)
+        self.assertFalse(os.listdir(os.path.join(self.directory.name,
+                                                 'locks')))
+
+    def test_local_tier_shared_by_threads(self):
+        first = self.make_cache()
+        first.set('a', 1)
+        first.shared.clear()
+        found = []
+        # Django создаёт бэкенд кэша в каждом потоке свой.
+        thread = threading.Thread(
+            target=lambda: found.append(self.make_cache().get('a')))
+        thread.start()
+        thread.join()
+        self.assertEqual(found, [1])
+
+    def test_concurrent_add(self):
+        results = []
+
+        def add(value):
+            results.append(self.make_cache().add('key', value))
+
+        threads = [threading.Thread(target=add, args=(value,))
+                   for value in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(True), 1)
+        self.assertFalse(os.listdir(os.path.join(self.directory.name,
+                                                 'locks')))
+
+    def test_abandoned_lock(self):
+        first = self.make_cache(LOCK_WAIT=30)
+        second = self.make_cache(LOCK_WAIT=30)
+        self.assertIsNone(first.get('page.index'))
+        # Ответ не закэшировали: блокировку снимает close() в конце запроса.
+        threading.Timer(0.1, first.close).start()
+        started = time.monotonic()
+        self.assertIsNone(second.get('page.index'))
+        self.assertLess(time.monotonic() - started, 5)
+        second.set('page.index', 'html')
+        self.assertFalse(os.listdir(os.path.join(self.directory.name,
+                                                 'locks')))
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='Author')
+        self.client = Client()
+        self.post = Post.objects.create(text='Котики <и> собаки',
+                                        author=self.author)
+        Post.objects.create(text='Только собаки', author=self.author)
+
+    def found(self, query, **params):
+        response = self.client.get(reverse('search'), {'q': query, **params})
+        return response, [post.text for post in response.context['posts']]
+
+    def test_search_edit_delete(self):
+        response, texts = self.found('котик')
+        self.assertEqual(texts, ['Котики <и> собаки'])
+        self.assertContains(response, '<mark>Котики</mark> &lt;и&gt;')
+        self.post.text = 'Хомяки'
+        self.post.save()
+        self.assertEqual(self.found('котик')[1], [])
+        self.assertEqual(self.found('хомяки')[1], ['Хомяки'])
+        self.post.delete()
+        self.assertEqual(self.found('хомяки')[1], [])
+        self.assertEqual(self.found('" OR *')[1], [])
+
+    def test_cursor_pagination(self):
+        for i in range(12):
+            Post.objects.create(text=f'Лошади {i}', author=self.author)
+        response, first_page = self.found('лошади')
+        nav = response.context['nav']
+        self.assertEqual(len(first_page), 10)
+        self.assertTrue(nav.has_older)
+        response = self.client.get(f"{reverse('search')}?{nav.older_query}")
+        second_page = [post.text for post in response.context['posts']]
+        self.assertEqual(len(second_page), 2)
+        self.assertFalse(set(first_page) & set(second_page))
+
+    def test_reindex(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO posts_post_fts(posts_post_fts) "
+                "VALUES ('delete-all')")
+        self.assertEqual(self.found('собаки')[1], [])
+        call_command('reindex_search', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(len(self.found('собаки')[1]), 2)
+
+    def test_failed_reindex_keeps_index(self):
+        with mock.patch('posts.search.Post.objects.filter',
+                        side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command('reindex_search', stdout=io.StringIO())
+        self.assertEqual(len(self.found('собаки')[1]), 2)
+
+
+class ThumbnailQueueTest(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        thumbnails._resolved.clear()
+        self.author = User.objects.create_user(username='Author')
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def upload(self):
+        byte_image = io.BytesIO()
+        Image.new('RGB', size=(500, 500), color=(255, 0, 0)).save(
+            byte_image, format='jpeg')
+        self.client.post(reverse('new_post'), data={
+            'text': 'post with image',
+            'image': ContentFile(byte_image.getvalue(), name='test.jpeg')})
+        return Post.objects.filter(text='post with image').first()
+
+    def test_original_until_thumbnail_ready(self):
+        with mock.patch('posts.thumbnails.transaction.on_commit',
+                        lambda callback: None):
+            post = self.upload()
+        self.assertIsNone(thumbnails.ready(post.image, 'card'))
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, post.image.url)
+        self.assertIsNotNone(thumbnails.ready(post.image, 'card'))
+        response = self.client.get(reverse('index'))
+        self.assertContains(response,
+                            thumbnails.ready(post.image, 'card').url)
+
+    def test_upload_queues_every_size(self):
+        with mock.patch('posts.thumbnails.transaction.on_commit',
+                        lambda callback: callback()):
+            post = self.upload()
+        for size in thumbnails.SIZES:
+            with self.subTest(size=size):
+                self.assertIsNotNone(thumbnails.ready(post.image, size))
+
+    def test_card_srcset_and_placeholder(self):
+        with mock.patch('posts.thumbnails.transaction.on_commit',
+                        lambda callback: callback()):
+            post = self.upload()
+        post.refresh_from_db()
+        self.assertTrue(post.image_placeholder.startswith(
+            'data:image/jpeg;base64,'))
+        response = self.client.get(reverse('index'))
+        for size in ('card-320', 'card-640-webp', 'card-webp'):
+            with self.subTest(size=size):
+                thumbnail = thumbnails.ready(post.image, size)
+                self.assertContains(
+                    response, f'{thumbnail.url} {thumbnail.width}w')
+        self.assertTrue(thumbnails.ready(post.image, 'card-webp')
+                        .name.endswith('.webp'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, post.image_placeholder)
+
+    def kvstore_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('index'))
+        return [q for q in context.captured_queries
+                if 'thumbnail_kvstore' in q['sql']]
+
+    def test_batched_lookup(self):
+        for _ in range(3):
+            self.upload()
+        self.client.get(reverse('index'))
+        thumbnails._resolved.clear()
+        self.assertEqual(len(self.kvstore_queries()), 1)
+        self.assertEqual(len(self.kvstore_queries()), 0)
+
+    def test_failed_image_backs_off(self):
+        with mock.patch('posts.thumbnails.transaction.on_commit',
+                        lambda callback: None):
+            post = self.upload()
+        with mock.patch('posts.thumbnails.get_thumbnail',
+                        side_effect=OSError) as broken:
+            with self.assertLogs('posts.thumbnails', 'ERROR'):
+                self.client.get(reverse('index'))
+            self.client.get(reverse('index'))
+            thumbnails.queue(post.image)
+        self.assertEqual(broken.call_count, 1)
+        self.assertTrue(thumbnails.failed_recently(post.image.name))
+        self.assertFalse(thumbnails._pending)
+
+
+class ImageUploadTest(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        thumbnails._resolved.clear()
+        self.author = User.objects.create_user(username='Author')
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def post_image(self, image, **save_options):
+        byte_image = io.BytesIO()
+        image.save(byte_image, format='jpeg', **save_options)
+        return self.client.post(reverse('new_post'), data={
+            'text': 'upload',
+            'image': ContentFile(byte_image.getvalue(), name='test.jpeg')})
+
+    def test_downscaled_without_exif(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: повернуть на 90°
+        exif[0x010f] = 'Camera'
+        self.post_image(Image.new('RGB', (3000, 1000)), exif=exif)
+        post = Post.objects.get(text='upload')
+        with Image.open(post.image.path) as saved:
+            self.assertEqual(saved.size, (853, 2560))
+            self.assertEqual(len(saved.getexif()), 0)
+        self.assertEqual(post.image.size, os.path.getsize(post.image.path))
+
+    @override_settings(POSTS_IMAGE_WORKERS=1)
+    def test_reencoded_in_worker_process(self):
+        with mock.patch('posts.uploads._pool',
+                        wraps=uploads._pool) as pool:
+            self.post_image(Image.new('RGB', (3000, 1000)))
+        pool.assert_called_once_with()
+        post = Post.objects.get(text='upload')
+        with Image.open(post.image.path) as saved:
+            self.assertEqual(saved.size, (2560, 853))
+        self.assertEqual(post.image.size, os.path.getsize(post.image.path))
+
+    @override_settings(POSTS_IMAGE_WORKERS=1)
+    def test_dead_worker_process_rejects_upload(self):
+        pool = mock.Mock()
+        pool.submit.return_value.result.side_effect = BrokenProcessPool
+        with mock.patch('posts.uploads._pool', return_value=pool):
+            response = self.post_image(Image.new('RGB', (20, 20)))
+        self.assertFormError(response, 'form', 'image',
+                             'Не удалось обработать изображение.')
+        pool.shutdown.assert_called_once_with(wait=False)
+
+    @override_settings(POSTS_IMAGE_MAX_BYTES=1024)
+    def test_oversized_file_rejected(self):
+        noise = Image.frombytes('L', (200, 200), os.urandom(200 * 200))
+        response = self.post_image(noise)
+        [error] = response.context['form'].errors['image']
+        self.assertTrue(error.startswith('Файл слишком большой'))
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POSTS_IMAGE_MAX_PIXELS=100)
+    def test_decompression_bomb_rejected(self):
+        with mock.patch('posts.uploads.reencode') as reencode:
+            response = self.post_image(Image.new('RGB', (20, 20)))
+        self.assertFormError(response, 'form', 'image',
+                             'Слишком большое изображение: 20×20.')
+        reencode.assert_not_called()
+
+    def test_metadata_filled_on_upload(self):
+        self.post_image(Image.new('RGB', (300, 200)))
+        post = Post.objects.get(text='upload')
+        with open(post.image.path, 'rb') as file:
+            content = file.read()
+        self.assertEqual((post.image_width, post.image_height), (300, 200))
+        self.assertEqual(post.image_format, 'JPEG')
+        self.assertEqual(post.image_bytes, len(content))
+        self.assertEqual(post.image_hash, hashlib.sha256(content).hexdigest())
+
+    def test_render_does_not_open_original(self):
+        with mock.patch('posts.thumbnails.transaction.on_commit',
+                        lambda callback: None):
+            self.post_image(Image.new('RGB', (300, 200)))
+        # Миниатюра не готова и не ставится в очередь: выводится оригинал.
+        with mock.patch('PIL.Image.open') as image_open, \
+                mock.patch('posts.thumbnails.queue'):
+            response = self.client.get(reverse('index'))
+        image_open.assert_not_called()
+        self.assertContains(response, 'width="300" height="200"')
+
+
+class ImageStorageTest(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.author = User.objects.create_user(username='Author')
+
+    def image(self, color, name='meme.jpeg'):
+        byte_image = io.BytesIO()
+        Image.new('RGB', (50, 50), color).save(byte_image, format='jpeg')
+        return ContentFile(byte_image.getvalue(), name=name)
+
+    def post(self, color, name='meme.jpeg'):
+        return Post.objects.create(author=self.author, text='meme',
+                                   image=self.image(color, name))
+
+    def test_identical_uploads_share_file(self):
+        first = self.post('red', 'a.jpeg')
+        second = self.post('red', 'b.jpeg')
+        other = self.post('blue')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertNotEqual(first.image.name, other.image.name)
+        self.assertEqual(first.image.name,
+                         f'posts/{first.image_hash[:2]}/'
+                         f'{first.image_hash}.jpeg')
+        self.assertEqual(ImageBlob.objects.get(name=first.image.name).refs,
+                         2)
+
+    def test_collect_unreferenced(self):
+        shared = self.post('red')
+        duplicate = self.post('red')
+        edited = self.post('blue')
+        old_name = edited.image.name
+        edited.image = self.image('green')
+        edited.save()
+        duplicate.delete()
+        self.assertEqual(blobs.collect(grace=60), 0)
+        self.assertEqual(blobs.collect(grace=0), 1)
+        storage = shared.image.storage
+        self.assertFalse(storage.exists(old_name))
+        self.assertTrue(storage.exists(shared.image.name))
+        self.assertTrue(storage.exists(edited.image.name))
+        self.assertEqual(ImageBlob.objects.get(name=shared.image.name).refs,
+                         1)
+
+    def test_collect_keeps_file_referenced_again(self):
+        post = self.post('red')
+        name = post.image.name
+        ImageBlob.objects.filter(name=name).update(refs=0,
+                                                   orphaned=timezone.now())
+        self.assertEqual(blobs.collect(grace=0), 0)
+        self.assertTrue(post.image.storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).refs, 1)
+
+
+class QueryPlanTest(TestCase):
+    """Основной запрос каждой страницы должен идти по индексу."""
+
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create(title='Группа', slug='group',
+                                          description='Описание')
+        self.author = User.objects.create_user(username='Author')
+        self.reader = User.objects.create_user(username='Reader')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.post = Post.objects.create(author=self.author, group=self.group,
+                                        text='Текст')
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий')
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def plan(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def main_query(self, url, table):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        return [query['sql'] for query in context.captured_queries
+                if f'FROM "{table}"' in query['sql']
+                and 'ORDER BY' in query['sql']][0]
+
+    def test_feeds_use_indexes(self):
+        pages = [
+            (reverse('index'), 'posts_post'),
+            (reverse('group', args=['group']), 'posts_post'),
+            (reverse('profile', args=['Author']), 'posts_post'),
+            (reverse('follow_index'), 'posts_timelineentry'),
+            (reverse('post', args=['Author', self.post.pk]),
+             'posts_comment'),
+        ]
+        for url, table in pages:
+            with self.subTest(url=url):
+                plan = self.plan(self.main_query(url, table))
+                scans = [step for step in plan
+                         if re.fullmatch(r'SCAN (TABLE )?\w+', step)]
+                self.assertEqual(scans, [], plan)
+                self.assertFalse([step for step in plan
+                                  if 'TEMP B-TREE' in step], plan)
+
+    def test_follower_lookup_uses_index(self):
+        plan = self.plan(*Follow.objects.filter(author=self.author)
+                         .values('user').query.sql_with_params())
+        self.assertIn('follow_author_user', ' '.join(plan))
+
+
+class TransferTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='Author',
+                                               password='secret')
+        self.reader = User.objects.create_user(username='Reader')
+        self.group = Group.objects.create(title='Группа', slug='group',
+                                          description='Описание')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.post = Post.objects.create(author=self.author, group=self.group,
+                                        text='Старый пост')
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Комментарий')
+        self.dump = tempfile.NamedTemporaryFile(suffix='.ndjson',
+                                                delete=False)
+        self.dump.close()
+        self.addCleanup(os.remove, self.dump.name)
+
+    def export(self, *args):
+        stderr = io.StringIO()
+        call_command('export_yatube', '-o', self.dump.name, *args,
+                     stderr=stderr)
+        with open(self.dump.name, encoding='utf-8') as dump:
+            return dump.read(), stderr.getvalue()
+
+    def load(self):
+        call_command('import_yatube', self.dump.name, '--batch-size', '2',
+                     stdout=io.StringIO())
+
+    def test_round_trip_remaps_keys(self):
+        pub_date = self.post.pub_date
+        self.export()
+        Post.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        # Занимаем старые id, чтобы импорт выдал новые.
+        Post.objects.create(author=User.objects.create_user('Other'),
+                            text='Чужой пост')
+        self.load()
+        post = Post.objects.get(text='Старый пост')
+        author = User.objects.get(username='Author')
+        self.assertEqual(post.author, author)
+        self.assertEqual(post.group.slug, 'group')
+        self.assertEqual(post.pub_date, pub_date)
+        self.assertTrue(author.check_password('secret'))
+        self.assertEqual(post.comments.get().author.username, 'Reader')
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(author.stats.followers, 1)
+        self.assertTrue(Follow.objects.filter(user__username='Reader',
+                                              author=author).exists())
+        self.assertEqual(TimelineEntry.objects.filter(
+            user__username='Reader').count(), 1)
+
+    def test_incremental_export_is_idempotent(self):
+        _, report = self.export()
+        watermark = report.split('--since ')[1].strip()
+        new_post = Post.objects.create(author=self.author, text='Новый пост')
+        dump, _ = self.export('--since', watermark)
+        self.assertNotIn('Старый пост', dump)
+        self.assertIn('Новый пост', dump)
+        new_post.delete()
+        self.load()
+        self.load()
+        self.assertEqual(Post.objects.filter(text='Новый пост').count(), 1)
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(Comment.objects.count(), 1)
+
+    def test_posts_with_same_date_survive(self):
+        twin = Post.objects.create(author=self.author, text='Близнец')
+        Post.objects.filter(pk=twin.pk).update(pub_date=self.post.pub_date)
+        Comment.objects.create(post=twin, author=self.author,
+                               text='К близнецу')
+        self.export()
+        Post.objects.all().delete()
+        self.load()
+        self.assertEqual(
+            set(Post.objects.values_list('uid', 'text')),
+            {(self.post.uid, 'Старый пост'), (twin.uid, 'Близнец')})
+        self.assertEqual(
+            Post.objects.get(uid=twin.uid).comments.get().text, 'К близнецу')
+
+    def test_post_without_uid_is_rejected(self):
+        dump, _ = self.export()
+        with open(self.dump.name, 'w', encoding='utf-8') as file:
+            file.write(dump.replace('"uid"', '"old_uid"'))
+        with self.assertRaisesMessage(ValueError, 'Пост без uid'):
+            self.load()
+
+
+class DatasetTest(TestCase):
+
+    def generate(self, *args):
+        call_command('generate_dataset', '--users', '50', '--groups', '3',
+                     '--posts', '200', '--comments', '100', '--follows', '5',
+                     '--batch-size', '64', *args, stdout=io.StringIO())
+
+    def snapshot(self):
+        return (list(Post.objects.order_by('pk').values_list(
+                    'pk', 'author', 'group', 'text', 'pub_date', 'uid')),
+                list(Comment.objects.order_by('pk')
+                     .values_list('post', 'created')),
+                list(User.objects.order_by('pk')
+                     .values_list('username', 'password', 'date_joined')),
+                list(Follow.objects.order_by('user', 'author')
+                     .values_list('user', 'author')))
+
+    def test_seeded_and_consistent(self):
+        self.generate('--seed', '7')
+        first = self.snapshot()
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 100)
+        self.assertEqual(
+            sum(Post.objects.values_list('comment_count', flat=True)), 100)
+        self.assertEqual(UserStats.objects.filter(
+            user__username__startswith='user').aggregate(
+                total=Sum('followers'))['total'], Follow.objects.count())
+        followers = sorted(UserStats.objects.values_list('followers',
+                                                         flat=True))
+        # Степенной закон: у самого популярного сильно больше медианы.
+        self.assertGreater(followers[-1], 5 * max(followers[25], 1))
+
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        self.generate('--seed', '7')
+        self.assertEqual(self.snapshot(), first)
+
+
+class BenchmarkTest(TestCase):
+    def test_views_within_query_budgets(self):
+        results = benchmarks.run([50, 500], repeat=1, users=40, follows=5)
+        self.assertEqual({result.case for result in results},
+                         set(benchmarks.BUDGETS))
+        self.assertEqual(benchmarks.check(results, timing=False), [])
+
+    def test_check_reports_growth(self):
+        make = benchmarks.Measurement
+        results = [make('index', 100, 3, 1.0, 10.0, 100),
+                   make('index', 10000, 5, 1.0, 90.0, 100)]
+        problems = benchmarks.check(results)
+        self.assertEqual(len(problems), 3)
+        self.assertIn('зависит от объёма', problems[1])
+
+
+class SQLStatsMiddlewareTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='sql', password='x')
+        self.factory = RequestFactory()
+
+    def test_normalize(self):
+        self.assertEqual(
+            middleware.normalize("SELECT * FROM t WHERE id IN (%s, %s, %s)"
+                                 "  AND name = 'a''b' LIMIT 20"),
+            'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?')
+
+    def test_headers(self):
+        response = self.client.get(reverse('index'))
+        self.assertGreater(int(response['X-SQL-Queries']), 0)
+        self.assertIn('sql;dur=', response['Server-Timing'])
+        self.assertNotIn('X-SQL-Repeated', response)
+
+    def test_headers_hidden_from_outside(self):
+        response = self.client.get(reverse('index'),
+                                   REMOTE_ADDR='203.0.113.7')
+        self.assertNotIn('X-SQL-Queries', response)
+        self.assertNotIn('Server-Timing', response)
+
+    def test_repeated_queries_logged_with_call_site(self):
+        def view(request):
+            for _ in range(6):
+                User.objects.filter(pk=self.user.pk).exists()
+            return HttpResponse()
+
+        handler = middleware.SQLStatsMiddleware(view)
+        with self.assertLogs('yatube.sql.slow', 'WARNING') as logs:
+            response = handler(self.factory.get('/'))
+        self.assertEqual(response['X-SQL-Queries'], '6')
+        self.assertEqual(response['X-SQL-Repeated'], '1')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['repeated'][0]['count'], 6)
+        self.assertTrue(record['repeated'][0]['site'].startswith(
+            os.path.join('posts', 'tests.py')))
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.registry.counters.clear()
+        metrics.registry.histograms.clear()
+
+    def test_views_templates_and_page_cache(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        response = self.client.get(reverse('metrics'))
+        text = response.content.decode()
+        self.assertIn('yatube_responses_total{status="200",view="index"} 2',
+                      text)
+        self.assertIn('yatube_request_duration_seconds_count'
+                      '{view="index"} 2', text)
+        self.assertIn('yatube_request_duration_seconds_bucket'
+                      '{view="index",le="+Inf"} 2', text)
+        self.assertIn('yatube_template_render_seconds_count'
+                      '{template="index.html"} 1', text)
+        self.assertIn('yatube_cache_requests_total{cache="page",'
+                      'result="hit",view="index"} 1', text)
+        self.assertIn('yatube_cache_requests_total{cache="page",'
+                      'result="miss",view="index"} 1', text)
+
+    def test_only_internal_addresses(self):
+        response = self.client.get(reverse('metrics'),
+                                   REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 404)
+
+    def test_processes_aggregated_through_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            other = {'counters': [['yatube_responses_total',
+                                   [['status', 200], ['view', 'index']], 3]],
+                     'histograms': []}
+            with open(os.path.join(directory, '1.json'), 'w') as file:
+                json.dump(other, file)
+            metrics.registry.inc('yatube_responses_total',
+                                 {'view': 'index', 'status': 200})
+            with self.settings(METRICS_DIR=directory):
+                metrics.flush(force=True)
+                self.assertTrue(os.path.exists(
+                    metrics._own_file(directory)))
+                text = metrics.render()
+        self.assertIn('yatube_responses_total{status="200",view="index"} 4',
+                      text)
+
+    def test_dead_processes_retired(self):
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        dump = {'counters': [['yatube_responses_total',
+                              [['status', 200], ['view', 'index']], 2]],
+                'histograms': []}
+        with tempfile.TemporaryDirectory() as directory:
+            names = [f'{dead.pid}.json', f'{os.getpid()}-1.json',
+                     metrics.RETIRED]
+            for name in names:
+                with open(os.path.join(directory, name), 'w') as file:
+                    json.dump(dump, file)
+            with self.settings(METRICS_DIR=directory):
+                metrics.flush(force=True)
+                text = metrics.render()
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                ['.retire.lock', os.path.basename(
+                    metrics._own_file(directory)), metrics.RETIRED])
+        self.assertIn('yatube_responses_total{status="200",view="index"} 6',
+                      text)
+
+    def test_fragment_cache_lookups(self):
+        with tempfile.TemporaryDirectory() as directory:
+            two_tier = TwoTierCache(directory, {'OPTIONS': {
+                'METRICS': {'template.cache.': 'fragment'}}})
+            two_tier.get('template.cache.cards')
+            two_tier.set('template.cache.cards', 'html')
+            two_tier.get('template.cache.cards')
+            two_tier.get('other')
+        self.assertEqual(
+            {labels: value for (name, labels), value
+             in metrics.registry.counters.items()
+             if name == 'yatube_cache_requests_total'},
+            {(('cache', 'fragment'), ('result', 'miss')): 1,
+             (('cache', 'fragment'), ('result', 'hit')): 1})
+
+
+class LoadTestTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='load',
+                                             password='secret')
+        self.group = Group.objects.create(title='Нагрузка', slug='load')
+        self.post = Post.objects.create(text='Запись', author=self.user,
+                                        group=self.group)
+
+    def test_mix_through_wsgi(self):
+        samples, elapsed = loadtest.run(requests=40, concurrency=1,
+                                        duration=60, password='secret')
+        self.assertEqual(len(samples), 40)
+        self.assertEqual([item for item in samples if not item.ok], [])
+        written = [item.scenario for item in samples]
+        self.assertEqual(Comment.objects.filter(post=self.post).count(),
+                         written.count('add_comment'))
+        self.assertEqual(Post.objects.count(),
+                         1 + written.count('new_post'))
+        rows = loadtest.report(samples, elapsed)
+        self.assertEqual(rows[-1]['requests'], 40)
+        self.assertEqual(rows[-1]['errors'], 0)
+
+    def test_errors_and_percentiles(self):
+        with self.assertRaises(loadtest.LoadTestError):
+            loadtest.run({'post_view': 1}, requests=1, concurrency=1,
+                         password='wrong')
+        samples, _ = loadtest.run(loadtest.parse_mix('profile=1'),
+                                  requests=3, concurrency=1)
+        self.assertEqual({item.scenario for item in samples}, {'profile'})
+        self.assertEqual(loadtest.percentile([1, 2, 3, 4], 0.5), 2)
+        self.assertEqual(loadtest.percentile([1, 2, 3, 4], 0.99), 4)
+
+    def test_runs_without_debug_toolbar(self):
+        seen = []
+
+        def scenario(*args):
+            seen.append(settings.DEBUG)
+            return real_scenario(*args)
+
+        real_scenario = loadtest._scenario
+        with self.settings(DEBUG=True), \
+                mock.patch.object(loadtest, '_scenario', scenario):
+            samples, _ = loadtest.run({'index': 1}, requests=2,
+                                      concurrency=1)
+        self.assertEqual(seen, [False, False])
+        self.assertTrue(all(item.ok for item in samples))
+
+        session = loadtest.Session()
+        session._send = mock.Mock(return_value=(
+            200, [], b'<div id="djDebug" class="djdt-hidden">'))
+        with self.assertRaisesMessage(loadtest.LoadTestError,
+                                      'debug_toolbar'):
+            session.request('GET', '/')
+
+
+class ProfilerTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.factory = RequestFactory()
+
+    def slow_view(self, request):
+        time.sleep(0.05)
+        return HttpResponse()
+
+    def profile(self, header='secret', **settings):
+        settings.setdefault('PROFILE_TOKEN', 'secret')
+        with self.settings(PROFILE_DIR=self.directory, **settings):
+            handler = profiling.ProfilerMiddleware(self.slow_view)
+            return handler(self.factory.get('/', HTTP_X_PROFILE=header))
+
+    def test_token_and_sample_rate(self):
+        response = self.profile(PROFILE_TOKEN='other')
+        self.assertNotIn('X-Profile-File', response)
+        response = self.profile(header='\xe9')
+        self.assertNotIn('X-Profile-File', response)
+        response = self.profile(PROFILE_TOKEN='')
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(os.listdir(self.directory), [])
+        # Случайная выборка профилируется, но имя файла не раскрывается.
+        response = self.profile(PROFILE_TOKEN='', PROFILE_SAMPLE_RATE=1)
+        self.assertNotIn('X-Profile-File', response)
+        self.assertEqual(os.listdir(self.directory), ['unresolved'])
+
+    def test_sampler_and_merge(self):
+        for _ in range(2):
+            response = self.profile(PROFILE_INTERVAL=0.001)
+        path = os.path.join(self.directory, response['X-Profile-File'])
+        stacks = profiling.read_collapsed(path)
+        self.assertTrue(any('slow_view' in stack for stack in stacks))
+
+        merged = os.path.join(self.directory, 'merged.txt')
+        out = io.StringIO()
+        call_command('merge_profiles', '--dir', self.directory,
+                     '-o', merged, stdout=out)
+        self.assertIn('unresolved: профилей 2', out.getvalue())
+        self.assertIn('slow_view', out.getvalue())
+        with open(merged) as file:
+            first = file.readline()
+        self.assertRegex(first, r'^unresolved;.+ \d+$')
+
+    def test_cprofile(self):
+        response = self.profile(PROFILE_MODE='cprofile')
+        self.assertTrue(response['X-Profile-File'].endswith('.prof'))
+        out = io.StringIO()
+        call_command('merge_profiles', '--dir', self.directory,
+                     '--sort', 'tottime', stdout=out)
+        self.assertIn('slow_view', out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTest(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='primary',
+                                             password='secret')
+        self.post = Post.objects.create(text='Только в основной базе',
+                                        author=self.user)
+        cache.clear()
+
+    def get(self, url):
+        return self.client.get(url)
+
+    def test_replica_pages_cached_apart(self):
+        routers._state.replica = 'replica'
+        self.addCleanup(setattr, routers._state, 'replica', None)
+        self.assertEqual(caching.feed_timeout(),
+                         settings.REPLICA_STICKY_SECONDS)
+        self.assertTrue(caching.feed_version(caching.ALL)
+                        .endswith('.replica'))
+
+    def test_feeds_read_from_replica_until_write(self):
+        # В реплике таблицы есть, а строк основной базы нет.
+        self.assertNotContains(self.get(reverse('index')), self.post.text)
+        self.assertEqual(self.get(reverse('profile',
+                                          args=['primary'])).status_code, 404)
+        self.assertContains(
+            self.get(reverse('post', args=['primary', self.post.pk])),
+            self.post.text)
+
+        response = self.client.post(reverse('login'),
+                                    {'username': 'primary',
+                                     'password': 'secret'})
+        self.assertIn(routers.STICKY_COOKIE, response.cookies)
+        self.assertContains(self.get(reverse('index')), self.post.text)
+        self.assertEqual(self.get(reverse('follow_index')).status_code, 200)
+
+    def test_writes_go_to_primary(self):
+        self.client.post(reverse('login'), {'username': 'primary',
+                                            'password': 'secret'})
+        self.client.post(reverse('add_comment',
+                                 args=['primary', self.post.pk]),
+                         {'text': 'Комментарий'})
+        self.assertTrue(Comment.objects.using('default')
+                        .filter(text='Комментарий').exists())
+        self.assertFalse(Comment.objects.using('replica').exists())
+
+
+@override_settings(SOCIAL_DATABASE='social')
+class SplitDatabasesTest(TestCase):
+    databases = {'default', 'social'}
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='writer',
+                                               password='secret')
+        self.reader = User.objects.create_user(username='reader',
+                                               password='secret')
+        self.post = Post.objects.create(text='Запись автора',
+                                        author=self.author)
+        self.client.post(reverse('login'), {'username': 'reader',
+                                            'password': 'secret'})
+
+    def test_social_tables_in_own_database(self):
+        self.client.get(reverse('profile_follow', args=['writer']))
+        self.client.post(reverse('add_comment',
+                                 args=['writer', self.post.pk]),
+                         {'text': 'Отдельная база'})
+        for model in (Comment, Follow):
+            self.assertEqual(model.objects.using('social').count(), 1)
+            self.assertEqual(model.objects.using('default').count(), 0)
+        self.assertTrue(Session.objects.using('social').exists())
+
+        response = self.client.get(reverse('post',
+                                           args=['writer', self.post.pk]))
+        self.assertContains(response, 'Отдельная база')
+        self.assertContains(response, 'reader')
+        self.assertContains(self.client.get(reverse('follow_index')),
+                            self.post.text)
+
+        Post.objects.update(comment_count=0)
+        UserStats.objects.update(followers=0)
+        call_command('recount', stdout=io.StringIO())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+        self.assertEqual(UserStats.objects.get(user=self.author).followers,
+                         1)
+
+        lines = [line for line, _ in transfer.export()]
+        self.assertTrue(any('"posts.comment"' in line
+                            and str(self.post.uid) in line
+                            for line in lines))
+        self.assertTrue(any('"posts.follow"' in line for line in lines))
+
+    def test_benchmark_counts_all_databases(self):
+        case = ('follow_index', 'get', reverse('follow_index'), {})
+        with CaptureQueriesContext(connections['default']) as default, \
+                CaptureQueriesContext(connections['social']) as social:
+            benchmarks._request(self.client, 'get', case[2], {})
+        # Журнал запросов сбрасывается в начале следующего запроса.
+        expected = len(default) + len(social)
+        self.assertGreater(len(social), 0)
+        result = benchmarks.measure(self.client, case, 0, repeat=1)
+        self.assertEqual(result.queries, expected)
+
+    def test_fresh_migrate(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with open(os.path.join(directory.name, 'split_settings.py'),
+                  'w') as file:
+            file.write(
+                'from yatube.settings import *\n'
+                f'DATABASES = {{\n'
+                f'    "default": {{"ENGINE": "django.db.backends.sqlite3",\n'
+                f'                "NAME": "{directory.name}/db.sqlite3"}},\n'
+                f'    "social": {{"ENGINE": "django.db.backends.sqlite3",\n'
+                f'               "NAME": "{directory.name}/social.sqlite3"}},'
+                f'\n}}\n'
+                'SOCIAL_DATABASE = "social"\n')
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='split_settings',
+                   PYTHONPATH=os.pathsep.join(
+                       [directory.name, settings.BASE_DIR]))
+        for database in ('default', 'social'):
+            result = subprocess.run(
+                [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'),
+                 'migrate', '--database', database, '--noinput'],
+                env=env, capture_output=True, text=True)
+            self.assertEqual(result.returncode, 0, result.stderr)
+
+    def test_export_skips_orphans(self):
+        # Так остаются строки, если удаление пользователя не дошло
+        # до второй базы.
+        missing = User.objects.order_by('-pk').first().pk + 1
+        Follow.objects.bulk_create([Follow(user_id=missing,
+                                           author=self.author)])
+        Comment.objects.bulk_create([Comment(post=self.post,
+                                             author_id=missing,
+                                             text='Осиротевший')])
+        models = [json.loads(line)['model']
+                  for line, _ in transfer.export()]
+        self.assertNotIn('posts.comment', models)
+        self.assertNotIn('posts.follow', models)
+
+    def test_deletes_reach_other_database(self):
+        self.client.get(reverse('profile_follow', args=['writer']))
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text='Чужой пост')
+        Comment.objects.create(post=self.post, author=self.author,
+                               text='Свой пост')
+        self.post.delete()
+        self.assertEqual(
+            set(Comment.objects.values_list('post', flat=True)), {None})
+        self.reader.delete()
+        self.assertEqual(list(Comment.objects.values_list('text', flat=True)),
+                         ['Свой пост'])
+        self.assertFalse(Follow.objects.exists())
+
+    def test_split_databases_command(self):
+        created = timezone.now() - timedelta(days=30)
+        comment = Comment.objects.using('default').create(
+            post=self.post, author=self.reader, text='Старая база')
+        Comment.objects.using('default').filter(pk=comment.pk).update(
+            created=created)
+        call_command('split_databases', '--delete', stdout=io.StringIO())
+        self.assertFalse(Comment.objects.using('default').exists())
+        self.assertEqual(Comment.objects.get().text, 'Старая база')
+        self.assertEqual(Comment.objects.get().created, created)
+
+    def test_split_databases_keeps_conflicting_rows(self):
+        taken = Comment.objects.using('default').create(
+            post=self.post, author=self.reader, text='Старая база')
+        moved = Comment.objects.using('default').create(
+            post=self.post, author=self.reader, text='Переедет')
+        Comment.objects.using('social').create(
+            pk=taken.pk, post=self.post, author=self.author,
+            text='Уже в новой базе')
+        with self.assertRaisesMessage(CommandError, '1 строк'):
+            call_command('split_databases', '--delete',
+                         stdout=io.StringIO())
+        self.assertEqual(
+            list(Comment.objects.using('default').values_list('pk', 'text')),
+            [(taken.pk, 'Старая база')])
+        self.assertEqual(Comment.objects.using('social').get(pk=taken.pk)
+                         .text, 'Уже в новой базе')
+        self.assertEqual(Comment.objects.using('social').get(pk=moved.pk)
+                         .text, 'Переедет')
+
+
+class SQLiteProfileTest(TestCase):
+    def connect(self, name, path=None):
+        if path is None:
+            directory = tempfile.TemporaryDirectory()
+            self.addCleanup(directory.cleanup)
+            path = os.path.join(directory.name, 'db.sqlite3')
+        settings_dict = dict(connection.settings_dict, NAME=path)
+        wrapper = type(connections['default'])(settings_dict, 'profile')
+        with self.settings(SQLITE_PROFILE=name):
+            wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            return {pragma: cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
+                    for pragma in ('journal_mode', 'synchronous',
+                                   'busy_timeout')}
+
+    def test_pragmas_on_new_connections(self):
+        self.assertEqual(self.connect('production'),
+                         {'journal_mode': 'wal', 'synchronous': 1,
+                          'busy_timeout': 20000})
+        self.assertEqual(self.connect('default')['journal_mode'], 'delete')
+        with self.settings(SQLITE_PROFILE='production'):
+            self.assertEqual(sqlite.pragmas()['cache_size'], -64 * 1024)
+
+    def test_default_profile_keeps_wal(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'db.sqlite3')
+        self.assertEqual(self.connect('production', path)['journal_mode'],
+                         'wal')
+        self.assertEqual(self.connect('default', path)['journal_mode'],
+                         'wal')
+
+
+class SQLiteBenchmarkTest(TransactionTestCase):
+    # Базы копируются backup API, а он ждёт конца открытой транзакции.
+    databases = '__all__'
+
+    def test_benchmark_command(self):
+        user = User.objects.create_user(username='bench', password='secret')
+        Post.objects.create(text='Запись', author=user)
+        out = io.StringIO()
+        call_command('benchmark_sqlite', '--requests', '10',
+                     '--concurrency', '1', '--password', 'secret',
+                     '--mix', 'new_post=1', stdout=out)
+        rows = out.getvalue().splitlines()[1:]
+        self.assertEqual([row.split()[0] for row in rows],
+                         ['default', 'production'])
+        self.assertEqual([row.split()[3] for row in rows], ['0.0%'] * 2)
+        # Записи прогона остались во временных копиях.
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], 0)
@@ -0,0 +1,294 @@
+"""Миниатюры постов готовятся заранее, в фоновом пуле потоков.
+
+Для карточки готовится несколько ширин в WebP и JPEG (SRCSETS) и
+заглушка Post.image_placeholder, которую лента показывает до загрузки.
+
+Шаблоны не вызывают {% thumbnail %} (он режет картинку прямо в запросе),
+а спрашивают готовые миниатюры через {% post_picture %}. Пока их нет,
+карточка показывает оригинал, а генерация ставится в очередь.
+Все размеры, которые используют шаблоны, перечислены в SIZES.
+
+Для страницы ленты метаданные миниатюр из key-value хранилища sorl
+читаются одним запросом (ThumbnailBatch), а найденные запоминаются
+в памяти процесса.
+
+Картинку, для которой генерация упала, снова ставят в очередь не раньше,
+чем через FAILURE_BACKOFF секунд, и с каждой неудачей интервал растёт
+вдвое (до FAILURE_BACKOFF_MAX). Неудачи хранятся в общем кэше, поэтому
+их видят все воркеры.
+"""
+import base64
+import hashlib
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.base import EXTENSIONS
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import serialize, tokey
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (EMPTY_VALUE,
+                                                       KVStore as CachedDB)
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from yatube.cache import LocalLRU
+
+from . import caching
+from .models import Post
+from .storage import image_storage
+
+logger = logging.getLogger(__name__)
+
+# Формат задан явно: иначе при THUMBNAIL_PRESERVE_FORMAT имя миниатюры
+# зависело бы от формата оригинала.
+CARD = {'crop': 'center', 'upscale': True, 'format': 'JPEG'}
+WEBP = dict(CARD, format='WEBP')
+SIZES = {
+    'card': ('960x339', CARD),
+    'card-640': ('640x226', CARD),
+    'card-320': ('320x113', CARD),
+    'card-webp': ('960x339', WEBP),
+    'card-640-webp': ('640x226', WEBP),
+    'card-320-webp': ('320x113', WEBP),
+}
+# Наборы для srcset: размер-запасной вариант → (JPEG, WebP) от узких к широким.
+SRCSETS = {
+    'card': (('card-320', 'card-640', 'card'),
+             ('card-320-webp', 'card-640-webp', 'card-webp')),
+}
+# Заглушка, пока картинка не загрузилась: крошечный JPEG в data: URI
+# с пропорциями карточки.
+PLACEHOLDER_SIZE = (24, 8)
+PLACEHOLDER_QUALITY = 40
+FAILURE_BACKOFF = 60
+FAILURE_BACKOFF_MAX = 24 * 60 * 60
+
+_executor = None
+_executor_lock = threading.Lock()
+# Картинки в очереди; меняется и из потоков пула.
+_pending = set()
+_pending_lock = threading.Lock()
+# Готовые миниатюры не меняются, их можно держать в памяти процесса.
+_resolved = LocalLRU(5000)
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.POSTS_THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails')
+        return _executor
+
+
+def _options(options):
+    # Те же умолчания, что подставляет ThumbnailBackend.get_thumbnail:
+    # от них зависит имя файла миниатюры.
+    options = dict(options)
+    backend = default.backend
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def source_file(image):
+    """Оригинал по FieldFile или имени — всегда в хранилище картинок."""
+    return ImageFile(image, image_storage)
+
+
+def thumbnail_file(image, size):
+    """Файл миниатюры под тем именем, под которым её сохранит sorl."""
+    geometry, options = SIZES[size]
+    options = _options(options)
+    key = tokey(source_file(image).key, geometry, serialize(options))
+    name = (f'{thumbnail_settings.THUMBNAIL_PREFIX}{key[:2]}/{key[2:4]}/'
+            f'{key}.{EXTENSIONS[options["format"]]}')
+    return ImageFile(name, default.storage)
+
+
+def ready(image, size):
+    """Готовая миниатюра или None; сама картинка не открывается."""
+    if not image:
+        return None
+    return default.kvstore.get(thumbnail_file(image, size))
+
+
+def _from_store(keys):
+    """Сырые значения key-value хранилища: кэш, затем один запрос в БД."""
+    kvstore = default.kvstore
+    values = kvstore.cache.get_many(keys)
+    missing = [key for key in keys if key not in values]
+    if missing:
+        rows = dict(KVStoreModel.objects.filter(key__in=missing)
+                    .values_list('key', 'value'))
+        fetched = {key: rows.get(key, EMPTY_VALUE) for key in missing}
+        kvstore.cache.set_many(fetched,
+                               thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+        values.update(fetched)
+    return {key: value for key, value in values.items()
+            if value is not None and value != EMPTY_VALUE}
+
+
+def resolve(pairs):
+    """Готовые миниатюры для пар (картинка, размер) за один поход в БД."""
+    if not isinstance(default.kvstore, CachedDB):
+        return {pair: ready(*pair) for pair in pairs}
+    keys = {pair: add_prefix(thumbnail_file(*pair).key) for pair in pairs}
+    found = {}
+    for key in keys.values():
+        thumbnail = _resolved.get(key)
+        if thumbnail is not None:
+            found[key] = thumbnail
+    missing = [key for key in keys.values() if key not in found]
+    if missing:
+        expires = time.time() + thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT
+        for key, value in _from_store(missing).items():
+            found[key] = deserialize_image_file(value)
+            _resolved.set(key, found[key], expires)
+    return {pair: found.get(key) for pair, key in keys.items()}
+
+
+class ThumbnailBatch:
+    """Миниатюры всех постов страницы; читаются при первом обращении.
+
+    Если карточки отдаются из кэша фрагментов, запроса не будет вовсе.
+    """
+
+    def __init__(self, posts):
+        self.posts = [post for post in posts if post.image]
+        self._thumbnails = None
+
+    def get(self, post, size):
+        if self._thumbnails is None:
+            self._thumbnails = resolve(
+                [(item.image.name, item_size) for item in self.posts
+                 for item_size in SIZES])
+        return self._thumbnails.get((post.image.name, size))
+
+
+class Picture:
+    """Готовые варианты картинки для <picture> и srcset."""
+
+    def __init__(self, fallback, jpeg, webp):
+        self.fallback = fallback
+        self.srcset = self._srcset(jpeg)
+        self.webp_srcset = self._srcset(webp)
+
+    @staticmethod
+    def _srcset(thumbnails):
+        return ', '.join(f'{thumbnail.url} {thumbnail.width}w'
+                         for thumbnail in thumbnails if thumbnail)
+
+
+def picture(post, size, lookup):
+    """Picture для поста или None, пока нет запасного JPEG.
+
+    lookup(post, size) возвращает готовую миниатюру или None.
+    """
+    fallback = lookup(post, size)
+    if fallback is None:
+        return None
+    jpeg, webp = SRCSETS.get(size, ((size,), ()))
+    return Picture(fallback,
+                   [lookup(post, name) for name in jpeg],
+                   [lookup(post, name) for name in webp])
+
+
+def placeholder(name):
+    """data: URI крошечной копии картинки с пропорциями карточки."""
+    with image_storage.open(name, 'rb') as file, Image.open(file) as image:
+        image.draft('RGB', (PLACEHOLDER_SIZE[0] * 4, PLACEHOLDER_SIZE[1] * 4))
+        small = ImageOps.fit(ImageOps.exif_transpose(image).convert('RGB'),
+                             PLACEHOLDER_SIZE)
+    output = io.BytesIO()
+    small.save(output, format='JPEG', quality=PLACEHOLDER_QUALITY)
+    encoded = base64.b64encode(output.getvalue()).decode()
+    return f'data:image/jpeg;base64,{encoded}'
+
+
+def attach(posts):
+    batch = ThumbnailBatch(posts)
+    for post in batch.posts:
+        post.thumbnail_batch = batch
+    return posts
+
+
+def _failure_key(name):
+    return f'thumbnail-failure:{hashlib.md5(name.encode()).hexdigest()}'
+
+
+def _record_failure(name):
+    attempts, _ = cache.get(_failure_key(name), (0, 0))
+    delay = min(FAILURE_BACKOFF * 2 ** attempts, FAILURE_BACKOFF_MAX)
+    cache.set(_failure_key(name), (attempts + 1, time.time() + delay),
+              FAILURE_BACKOFF_MAX * 2)
+
+
+def failed_recently(name):
+    _, retry_at = cache.get(_failure_key(name), (0, 0))
+    return time.time() < retry_at
+
+
+def generate(name, scopes=()):
+    try:
+        source = source_file(name)
+        for geometry, options in SIZES.values():
+            get_thumbnail(source, geometry, **options)
+        # Одинаковые файлы делят и заглушку.
+        Post.objects.filter(image=name, image_placeholder='').update(
+            image_placeholder=placeholder(name))
+    except Exception:
+        logger.exception('Не удалось подготовить миниатюры для %s', name)
+        _record_failure(name)
+    else:
+        cache.delete(_failure_key(name))
+        # Закэшированные карточки показывают оригинал — сбросим их.
+        caching.bump(*scopes)
+    finally:
+        with _pending_lock:
+            _pending.discard(name)
+
+
+def _work(name, scopes):
+    try:
+        generate(name, scopes)
+    finally:
+        connections.close_all()
+
+
+def queue(image, scopes=()):
+    if not image:
+        return
+    with _pending_lock:
+        if image.name in _pending:
+            return
+        _pending.add(image.name)
+    if failed_recently(image.name):
+        with _pending_lock:
+            _pending.discard(image.name)
+        return
+    if not settings.POSTS_THUMBNAIL_WORKERS:
+        generate(image.name, scopes)
+        return
+    _pool().submit(_work, image.name, tuple(scopes))
+
+
+def queue_for(post):
+    """Ставит миниатюры поста в очередь после коммита транзакции."""
+    if post.image:
+        scopes = caching.scopes_for(post)
+        transaction.on_commit(lambda: queue(post.image, scopes))
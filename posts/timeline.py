@@ -0,0 +1,155 @@
+"""Материализованная лента подписок (fan-out on write).
+
+Новый пост раскладывается в TimelineEntry всех подписчиков автора,
+поэтому follow_index читает страницу одним проходом по индексу
+(user, -pub_date, -post). Посты авторов, у которых подписчиков не меньше
+POSTS_FANOUT_MAX_FOLLOWERS, не раскладываются и подтягиваются
+при чтении (pull): Feed сливает их с лентой по тому же ключу.
+
+Ленты обрезаются до POSTS_TIMELINE_LENGTH на каждом TRIM_EVERY-м посте
+автора у всех его подписчиков, поэтому лента не бывает длиннее
+POSTS_TIMELINE_LENGTH + TRIM_EVERY × число подписок.
+"""
+import heapq
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery
+
+from yatube.routers import across
+
+from .paginators import Keyset
+from .models import Follow, Post, TimelineEntry, UserStats
+
+BATCH_SIZE = 500
+# Обрезаем ленты не на каждом посте автора, а на каждом N-м:
+# длина ленты может ненадолго превысить лимит, зато запись дешевле.
+TRIM_EVERY = 20
+
+
+def is_pull_author(author):
+    return UserStats.objects.filter(
+        user=author,
+        followers__gte=settings.POSTS_FANOUT_MAX_FOLLOWERS).exists()
+
+
+def pull_authors(user):
+    authors = Follow.objects.filter(user=user).values_list('author',
+                                                           flat=True)
+    return (UserStats.objects.filter(
+        user__in=across(authors, UserStats),
+        followers__gte=settings.POSTS_FANOUT_MAX_FOLLOWERS)
+        .values_list('user', flat=True))
+
+
+def fan_out(post):
+    followers, posts = (UserStats.objects.filter(user=post.author)
+                        .values_list('followers', 'posts')
+                        .first() or (0, 0))
+    if followers >= settings.POSTS_FANOUT_MAX_FOLLOWERS:
+        return
+    trim = posts % TRIM_EVERY == 0
+    batch = []
+    for user_id in (Follow.objects.filter(author=post.author)
+                    .values_list('user', flat=True).iterator()):
+        batch.append(TimelineEntry(user_id=user_id, post=post,
+                                   pub_date=post.pub_date))
+        if len(batch) == BATCH_SIZE:
+            _write(batch, trim)
+            batch = []
+    if batch:
+        _write(batch, trim)
+
+
+def _write(entries, trim):
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+    if trim:
+        trim_timelines([entry.user_id for entry in entries])
+
+
+def backfill(user, author):
+    if is_pull_author(author):
+        return
+    posts = (Post.objects.filter(author=author)
+             .values_list('pk', 'pub_date')
+             [:settings.POSTS_TIMELINE_LENGTH])
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(user=user, post_id=pk, pub_date=pub_date)
+         for pk, pub_date in posts],
+        batch_size=BATCH_SIZE, ignore_conflicts=True)
+    trim_timelines([user.pk])
+
+
+def remove(user, author):
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+
+def trim_timelines(user_ids):
+    length = settings.POSTS_TIMELINE_LENGTH
+    cutoff = (TimelineEntry.objects.filter(user=OuterRef('user'))
+              .order_by('-pub_date').values('pub_date')[length - 1:length])
+    TimelineEntry.objects.filter(
+        user__in=user_ids, pub_date__lt=Subquery(cutoff)).delete()
+
+
+def rebuild(user):
+    """Собирает ленту заново одним INSERT … SELECT по всем подпискам."""
+    authors = (Follow.objects.filter(user=user)
+               .exclude(author__in=across(pull_authors(user), Follow))
+               .values_list('author', flat=True))
+    posts = (Post.objects.filter(author__in=across(authors, Post))
+             .order_by('-pub_date')
+             .values_list('pk', 'pub_date')[:settings.POSTS_TIMELINE_LENGTH])
+    sql, params = posts.query.sql_with_params()
+    table = TimelineEntry._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        TimelineEntry.objects.filter(user=user).delete()
+        cursor.execute(
+            f'INSERT INTO {table} (user_id, post_id, pub_date) '
+            f'SELECT %s, * FROM ({sql}) AS posts', (user.pk, *params))
+
+
+class Feed:
+    """Лента подписок для paginate: строки TimelineEntry пользователя
+    и посты pull-авторов, слитые по (pub_date, id)."""
+
+    def __init__(self, user, posts=None):
+        self.posts = Post.objects.all() if posts is None else posts
+        pull = list(pull_authors(user))
+        entries = TimelineEntry.objects.filter(user=user)
+        if pull:
+            # Посты, разложенные до того, как автор стал pull-автором.
+            entries = entries.exclude(post__author__in=pull)
+        self.sources = [Keyset(entries.values_list('pub_date', 'post_id'),
+                               pk='post_id')]
+        if pull:
+            self.sources.append(Keyset(
+                Post.objects.filter(author__in=pull)
+                .values_list('pub_date', 'pk')))
+
+    def _load(self, rows):
+        found = self.posts.in_bulk([pk for _, pk in rows])
+        return [found[pk] for _, pk in rows if pk in found]
+
+    def older(self, cursor, limit, offset=0):
+        rows = heapq.merge(*(source.older(cursor, offset + limit)
+                             for source in self.sources), reverse=True)
+        return self._load(list(rows)[offset:offset + limit])
+
+    def newer(self, cursor, limit):
+        rows = heapq.merge(*(source.newer(cursor, limit)
+                             for source in self.sources))
+        return self._load(list(rows)[:limit])
+
+    def keys_older(self, cursor, limit):
+        keys = heapq.merge(*(source.keys_older(cursor, limit)
+                             for source in self.sources), reverse=True)
+        return list(keys)[:limit]
+
+    def keys_newer(self, cursor, limit):
+        keys = heapq.merge(*(source.keys_newer(cursor, limit)
+                             for source in self.sources))
+        return list(keys)[:limit]
+
+    def count(self):
+        return sum(source.count() for source in self.sources)
@@ -0,0 +1,157 @@
+"""Приём картинок постов с ограниченным расходом памяти.
+
+* ImageUploadHandler пишет загрузку на диск кусками и перестаёт писать,
+  как только файл превысил POSTS_IMAGE_MAX_BYTES.
+* check() смотрит только заголовок картинки (Image.open не декодирует
+  пиксели) и отсекает «бомбы» по числу пикселей.
+* reencode() уменьшает большие картинки до POSTS_IMAGE_MAX_SIDE,
+  поворачивает по EXIF и сохраняет без метаданных. Запрос ждёт готовый
+  файл, но декодирует его пул процессов (POSTS_IMAGE_WORKERS): память
+  под пиксели занимает не веб-воркер, и если ядро убьёт процесс пула,
+  загрузка просто получит ошибку формы. Пул запускается через forkserver,
+  поэтому его процессы не наследуют память и соединения веб-воркера.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_all_start_methods, get_context
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps
+
+FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            method = ('forkserver' if 'forkserver' in get_all_start_methods()
+                      else 'spawn')
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.POSTS_IMAGE_WORKERS,
+                mp_context=get_context(method))
+        return _executor
+
+
+def _discard(pool):
+    global _executor
+    with _executor_lock:
+        if _executor is pool:
+            _executor = None
+    pool.shutdown(wait=False)
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.file.oversized = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.POSTS_IMAGE_MAX_BYTES:
+            # Дочитываем поток, но на диск больше не пишем.
+            self.file.oversized = True
+            return None
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        upload = super().file_complete(file_size)
+        upload.size = self.received
+        return upload
+
+
+def check(upload):
+    if getattr(upload, 'oversized', False):
+        raise ValidationError(
+            'Файл слишком большой: не больше %(limit)s.',
+            params={'limit': filesizeformat(settings.POSTS_IMAGE_MAX_BYTES)})
+    image = getattr(upload, 'image', None)
+    if image is None:
+        upload.seek(0)
+        image = Image.open(upload)
+    width, height = image.size
+    if width * height > settings.POSTS_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Слишком большое изображение: %(width)d×%(height)d.',
+            params={'width': width, 'height': height})
+
+
+def describe(file):
+    """Размеры, формат, объём и SHA-256 файла без декодирования пикселей."""
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    with Image.open(file) as image:
+        (width, height), image_format = image.size, image.format or ''
+    file.seek(0)
+    # Хранилище называет файл по этому же хэшу — не считаем его дважды.
+    file.content_hash = digest.hexdigest()
+    return {'image_width': width, 'image_height': height,
+            'image_format': image_format, 'image_bytes': size,
+            'image_hash': file.content_hash}
+
+
+def reencode(path, max_side, quality):
+    """Уменьшает картинку и убирает метаданные, перезаписывая файл."""
+    with Image.open(path) as source:
+        image_format = source.format
+        if image_format not in FORMATS or getattr(source, 'is_animated',
+                                                  False):
+            return os.path.getsize(path)
+        # Для JPEG draft() декодирует сразу в уменьшенном масштабе.
+        source.draft('RGB', (max_side, max_side))
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        options = {}
+        if image_format == 'JPEG':
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            options = {'quality': quality, 'optimize': True,
+                       'progressive': True}
+        image.load()
+    # Пишем в тот же файл (тот же inode): открытый дескриптор загрузки
+    # увидит новое содержимое.
+    with open(path, 'r+b') as output:
+        image.save(output, format=image_format, **options)
+        output.truncate()
+    return os.path.getsize(path)
+
+
+def process(upload):
+    """Проверяет загрузку и пережимает её на месте."""
+    check(upload)
+    if not isinstance(upload, TemporaryUploadedFile):
+        return upload
+    args = (upload.temporary_file_path(), settings.POSTS_IMAGE_MAX_SIDE,
+            settings.POSTS_IMAGE_QUALITY)
+    if not settings.POSTS_IMAGE_WORKERS:
+        size = reencode(*args)
+    else:
+        pool = _pool()
+        try:
+            size = pool.submit(reencode, *args).result()
+        except BrokenProcessPool:
+            # Процесс пула погиб (скорее всего, не хватило памяти);
+            # следующая загрузка поднимет новый пул.
+            _discard(pool)
+            raise ValidationError(
+                'Не удалось обработать изображение.') from None
+    upload.file.seek(0)
+    upload.size = size
+    return upload
@@ -1,36 +1,40 @@
 from django.shortcuts import render, get_object_or_404, redirect
-from .models import Post, Group, User, Follow
+from .models import Comment, Post, Group, User, Follow
 from .forms import PostForm, CommentForm
+from .paginators import Navigation, page_number, paginate
+from . import caching, counters, feeds, search, thumbnails
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
-from django.views.decorators.cache import cache_page
+from yatube import routers
 
 
-@cache_page(20, key_prefix='index_page')
+@caching.cache_feed(lambda: caching.ALL)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    post_list = feeds.everything()
+    paginator, page, nav = paginate(request, post_list)
+    thumbnails.attach(page)
     return render(
         request,
         'index.html',
-        {'page': page, 'paginator': paginator}
+        {'page': page, 'paginator': paginator, 'nav': nav,
+         'feed_version': caching.feed_version(caching.ALL),
+         'feed_timeout': caching.feed_timeout()}
     )
 
 
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    posts = feeds.for_group(group)
+    paginator, page, nav = paginate(request, posts)
+    thumbnails.attach(page)
     return render(request,
                   "group.html",
                   {"group": group,
                    "page": page,
-                   'paginator': paginator})
+                   'paginator': paginator,
+                   'nav': nav,
+                   'feed_version': caching.feed_version(
+                       caching.group_scope(slug)),
+                   'feed_timeout': caching.feed_timeout()})
 
 
 @login_required
@@ -40,15 +44,16 @@ def new_post(request):
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        thumbnails.queue_for(post)
         return redirect('index')
     return render(request, 'new_post.html', {'form': form})
 
 
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    paginator = Paginator(author.posts.all(), 10)
-    page_number = request.GET.get('page')
-    page = paginator.get_page(page_number)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
+    paginator, page, nav = paginate(request, feeds.for_author(author))
+    thumbnails.attach(page)
     following = False
     if request.user.is_authenticated and request.user != author:
         following = request.user.follower.filter(author=author).exists()
@@ -57,20 +62,31 @@ def profile(request, username):
                   {'author': author,
                    'page': page,
                    'paginator': paginator,
+                   'nav': nav,
+                   'stats': counters.stats_for(author),
+                   'feed_version': caching.feed_version(
+                       caching.author_scope(username)),
+                   'feed_timeout': caching.feed_timeout(),
                    'following': following})
 
 
 def post_view(request, username, post_id):
-    post = get_object_or_404(Post, pk=post_id, author__username=username)
+    post = get_object_or_404(
+        feeds.everything().select_related('author__stats'),
+        pk=post_id, author__username=username)
     author = post.author
-    count = author.posts.count()
+    stats = counters.stats_for(author)
     form = CommentForm()
     items = post.comments.all()
+    # Авторы комментариев могут быть в другой базе.
+    items = (items.select_related('author')
+             if routers.same_database(Comment, User)
+             else items.prefetch_related('author'))
     following = False
     if request.user.is_authenticated and request.user != author:
         following = request.user.follower.filter(author=author).exists()
     return render(request,
-                  'post.html', {'post': post, 'author': author, 'count': count,
+                  'post.html', {'post': post, 'author': author, 'stats': stats,
                                 'form': form, 'items': items,
                                 'following': following})
 
@@ -87,6 +103,8 @@ def post_edit(request, username, post_id):
             post = form.save(commit=False)
             post.author = request.user
             post.save()
+            if 'image' in form.changed_data:
+                thumbnails.queue_for(post)
             return redirect('post', username=username, post_id=post.id)
         return render(request, 'new_post.html', {'form': form,
                                                  'is_created': True,
@@ -122,15 +140,14 @@ def add_comment(request, username, post_id):
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.all().filter(author__following__user=request.user)
-    paginator = Paginator(posts, 10)
-    page_number = request.GET.get("page")
-    page = paginator.get_page(page_number)
+    posts = feeds.for_follower(request.user)
+    paginator, page, nav = paginate(request, posts)
+    thumbnails.attach(page)
     return render(request,
                   "follow.html",
                   {"page": page,
                    "paginator": paginator,
-                   "page_number": page_number})
+                   "nav": nav})
 
 
 @login_required
@@ -149,3 +166,18 @@ def profile_unfollow(request, username):
     if follower.follower.filter(author=author).exists() and follower != author:
         follower.follower.get(author=author).delete()
     return redirect('profile', username=username)
+
+
+def post_search(request):
+    query = request.GET.get('q', '')
+    after = search.RankCursor.decode(request.GET.get('after'))
+    before = search.RankCursor.decode(request.GET.get('before'))
+    posts, has_newer, has_older = search.search(query, after, before)
+    first = last = None
+    if posts:
+        first = search.RankCursor(posts[0].rank, posts[0].pk)
+        last = search.RankCursor(posts[-1].rank, posts[-1].pk)
+    nav = Navigation(request.GET, page_number(request.GET.get('page')),
+                     first, last, has_newer, has_older)
+    return render(request, 'search.html',
+                  {'query': query, 'posts': posts, 'nav': nav})
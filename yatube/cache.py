@@ -0,0 +1,300 @@
+"""Двухуровневый кэш: LRU в памяти процесса поверх общего файлового кэша.
+
+Общий уровень (FileBasedCache) виден всем процессам-воркерам, поэтому
+дорогая страница пересчитывается один раз, а не в каждом процессе.
+Для ключей из SINGLE_FLIGHT работает защита от «лавины»:
+
+* при промахе пересчитывать идёт только процесс, взявший блокировку,
+  остальные ждут значение до LOCK_WAIT секунд;
+* незадолго до истечения ключ с некоторой вероятностью считается
+  промахом (XFetch), и один из читателей обновляет его заранее,
+  пока остальные получают ещё действующее значение.
+
+Локальный уровень, как и locmem, хранит значения сериализованными:
+объект, который вызывающий изменил после set() или get() (например,
+заголовки закэшированного ответа), не меняет того, что получат другие.
+Django создаёт бэкенд кэша в каждом потоке заново, поэтому LRU, как
+и словарь LocMemCache, общий для всех экземпляров с тем же LOCATION.
+
+Блокировки, которые так и не закончились set() (ответ не кэшируется
+или представление упало), снимает close() в конце запроса, а
+ожидающие перестают ждать, как только файл блокировки исчез.
+"""
+import fcntl
+import hashlib
+import math
+import os
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+
+from yatube import metrics
+
+# LOCATION -> LocalLRU, общий для потоков процесса.
+_locals = {}
+_locals_lock = threading.Lock()
+
+
+class LocalLRU:
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            envelope, expires = item
+            if expires <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return envelope
+
+    def set(self, key, envelope, expires):
+        with self._lock:
+            self._data[key] = (envelope, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TwoTierCache(BaseCache):
+    # Сколько промахов помнить, чтобы измерить время пересчёта ключа.
+    MAX_PENDING = 10000
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        shared_params = {key: value for key, value in params.items()
+                         if key != 'OPTIONS'}
+        shared_params['OPTIONS'] = {
+            key: options[key] for key in ('MAX_ENTRIES', 'CULL_FREQUENCY')
+            if key in options}
+        self.shared = FileBasedCache(location, shared_params)
+        with _locals_lock:
+            self.local = _locals.setdefault(
+                location, LocalLRU(options.get('LOCAL_MAX_ENTRIES', 1000)))
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 5)
+        self.local_skip = tuple(options.get('LOCAL_SKIP', ()))
+        self.single_flight = tuple(options.get('SINGLE_FLIGHT', ()))
+        # Префикс ключа -> имя кэша в метриках попаданий.
+        self.metrics = dict(options.get('METRICS', {}))
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 30)
+        self.lock_wait = options.get('LOCK_WAIT', 2)
+        self.poll_interval = options.get('POLL_INTERVAL', 0.05)
+        self.beta = options.get('EARLY_REFRESH_BETA', 1.0)
+        self._lock_dir = os.path.join(os.path.abspath(location), 'locks')
+        os.makedirs(self._lock_dir, exist_ok=True)
+        self._misses = {}
+        self._held = set()
+
+    def _keep_local(self, key):
+        return self.local_timeout and not key.startswith(self.local_skip)
+
+    def _is_single_flight(self, key):
+        return key.startswith(self.single_flight)
+
+    def _lock_path(self, made_key):
+        digest = hashlib.md5(made_key.encode()).hexdigest()
+        return os.path.join(self._lock_dir, f'{digest}.lock')
+
+    def _acquire(self, made_key):
+        path = self._lock_path(made_key)
+        for _ in range(2):
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                self._held.add(made_key)
+                return True
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(path)
+                except FileNotFoundError:
+                    continue
+                if age < self.lock_timeout:
+                    return False
+                # Владелец блокировки упал, не записав значение.
+                self._unlink(path)
+        return False
+
+    def _release(self, made_key):
+        if made_key in self._held:
+            self._held.discard(made_key)
+            self._unlink(self._lock_path(made_key))
+
+    @contextmanager
+    def _exclusive(self, made_key):
+        # Блокировка между процессами на чтение-изменение-запись ключа.
+        # Владелец удаляет файл, пока держит flock; тот, кто дождался
+        # flock на уже удалённом файле, открывает файл заново.
+        path = self._lock_path(made_key)[:-len('.lock')] + '.incr'
+        while True:
+            with open(path, 'a') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                try:
+                    current = os.stat(path).st_ino
+                except FileNotFoundError:
+                    current = None
+                if current != os.fstat(handle.fileno()).st_ino:
+                    continue
+                try:
+                    yield
+                finally:
+                    self._unlink(path)
+                return
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _refresh_early(self, expires, delta):
+        if expires is None or not delta:
+            return False
+        gap = -delta * self.beta * math.log(1 - random.random())
+        return time.time() + gap >= expires
+
+    def _read(self, key, made_key, version):
+        data = self.local.get(made_key)
+        if data is not None:
+            return pickle.loads(data)
+        envelope = self.shared.get(key, version=version)
+        if envelope is not None and self._keep_local(key):
+            self._remember(made_key, envelope)
+        return envelope
+
+    def _remember(self, made_key, envelope):
+        expires = time.time() + self.local_timeout
+        if envelope[1] is not None:
+            expires = min(expires, envelope[1])
+        self.local.set(made_key,
+                       pickle.dumps(envelope, pickle.HIGHEST_PROTOCOL),
+                       expires)
+
+    def _miss(self, made_key, default):
+        if len(self._misses) > self.MAX_PENDING:
+            self._misses.clear()
+        self._misses[made_key] = time.monotonic()
+        return default
+
+    def _count(self, key, hit):
+        for prefix, name in self.metrics.items():
+            if key.startswith(prefix):
+                metrics.cache_lookup(name, hit)
+                return
+
+    def get(self, key, default=None, version=None):
+        made_key = self.make_key(key, version)
+        self.validate_key(made_key)
+        envelope = self._read(key, made_key, version)
+        if self.metrics:
+            self._count(key, envelope is not None)
+        if not self._is_single_flight(key):
+            return default if envelope is None else envelope[0]
+
+        if envelope is not None:
+            value, expires, delta = envelope
+            if self._refresh_early(expires, delta) and self._acquire(made_key):
+                return self._miss(made_key, default)
+            return value
+        if self._acquire(made_key):
+            return self._miss(made_key, default)
+
+        deadline = time.monotonic() + self.lock_wait
+        lock_path = self._lock_path(made_key)
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            envelope = self.shared.get(key, version=version)
+            if envelope is not None:
+                return envelope[0]
+            if not os.path.exists(lock_path):
+                # Владелец отказался от пересчёта, не записав значение.
+                self._acquire(made_key)
+                break
+        return self._miss(made_key, default)
+
+    def has_key(self, key, version=None):
+        made_key = self.make_key(key, version)
+        return (self.local.get(made_key) is not None
+                or self.shared.has_key(key, version=version))
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        made_key = self.make_key(key, version)
+        self.validate_key(made_key)
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        started = self._misses.pop(made_key, None)
+        delta = time.monotonic() - started if started is not None else 0
+        expires = self.get_backend_timeout(timeout)
+        envelope = (value, expires, delta)
+        self.shared.set(key, envelope, timeout, version=version)
+        if self._keep_local(key):
+            self._remember(made_key, envelope)
+        else:
+            self.local.delete(made_key)
+        self._release(made_key)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        made_key = self.make_key(key, version)
+        self.validate_key(made_key)
+        with self._exclusive(made_key):
+            if self.shared.has_key(key, version=version):
+                return False
+            self.set(key, value, timeout, version)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        envelope = self.shared.get(key, version=version)
+        if envelope is None:
+            return False
+        self.set(key, envelope[0], timeout, version)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        made_key = self.make_key(key, version)
+        self.local.delete(made_key)
+        with self._exclusive(made_key):
+            envelope = self.shared.get(key, version=version)
+            if envelope is None:
+                raise ValueError("Key '%s' not found" % key)
+            value, expires, _ = envelope
+            new_value = value + delta
+            timeout = (None if expires is None
+                       else max(expires - time.time(), 0))
+            self.shared.set(key, (new_value, expires, 0), timeout,
+                            version=version)
+        return new_value
+
+    def delete(self, key, version=None):
+        made_key = self.make_key(key, version)
+        self.local.delete(made_key)
+        self._release(made_key)
+        self.shared.delete(key, version=version)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def close(self, **kwargs):
+        # Django вызывает close() в конце каждого запроса.
+        for made_key in list(self._held):
+            self._release(made_key)
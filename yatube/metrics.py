@@ -0,0 +1,302 @@
+"""Метрики сайта в текстовом формате Prometheus.
+
+Каждый процесс-воркер копит в памяти:
+
+* гистограмму времени ответа по имени URL и счётчик ответов по статусам;
+* гистограмму времени рендера шаблонов страниц;
+* попадания и промахи кэшей лент (страницы и фрагменты).
+
+Не чаще раза в METRICS_FLUSH_INTERVAL секунд процесс атомарно
+переписывает свой файл <pid>-<start>.json в METRICS_DIR; время старта
+процесса в имени отличает его от прежнего владельца того же pid.
+Эндпоинт /metrics/ складывает файлы всех процессов, подставляя вместо
+своего файла свежие значения из памяти.
+
+При первой записи процесс переносит файлы завершившихся процессов
+в retired.json и удаляет их: каталог не растёт с перезапусками
+воркеров, а счётчики при этом не уменьшаются.
+"""
+import fcntl
+import glob
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.template.backends.django import DjangoTemplates
+
+# Границы корзин гистограмм, секунды.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HELP = {
+    'yatube_request_duration_seconds': ('histogram',
+                                        'Время ответа по имени URL'),
+    'yatube_responses_total': ('counter', 'Ответы по имени URL и статусу'),
+    'yatube_template_render_seconds': ('histogram',
+                                       'Время рендера шаблона страницы'),
+    'yatube_cache_requests_total': ('counter',
+                                    'Обращения к кэшам лент по результату'),
+}
+
+
+class Registry:
+    """Значения метрик процесса: {(метрика, метки): значение}."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            # Корзины, затем сумма и число наблюдений.
+            values = self.histograms.setdefault(key,
+                                                [0] * (len(BUCKETS) + 3))
+            values[bisect_left(BUCKETS, seconds)] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    def dump(self):
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value
+                             in self.counters.items()],
+                'histograms': [[name, labels, list(values)]
+                               for (name, labels), values
+                               in self.histograms.items()],
+            }
+
+
+registry = Registry()
+_flushed = {'at': 0.0, 'retired': set()}
+
+RETIRED = 'retired.json'
+_PROCESS_FILE = re.compile(r'^(\d+)(?:-(\d+))?\.json$')
+
+
+def _start_time(pid):
+    """Время старта процесса в тиках часов из /proc или None."""
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            # Имя процесса в скобках может содержать пробелы.
+            return int(stat.read().rsplit(')', 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+_START = _start_time(os.getpid()) or int(time.time())
+
+
+def _own_file(directory):
+    return os.path.join(directory, f'{os.getpid()}-{_START}.json')
+
+
+def _alive(pid, start):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    if start is None:
+        return True
+    # Тот же pid мог достаться новому процессу.
+    started = _start_time(pid)
+    return started is None or started == start
+
+
+def _load(path):
+    try:
+        with open(path) as source:
+            return json.load(source)
+    except (OSError, ValueError):
+        # Файл мог исчезнуть или ещё не дописаться.
+        return None
+
+
+def _write(directory, path, dump):
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(descriptor, 'w') as temp:
+        json.dump(dump, temp)
+    os.replace(temp_path, path)
+
+
+def retire(directory):
+    """Переносит метрики завершившихся процессов в retired.json."""
+    with open(os.path.join(directory, '.retire.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        dead = []
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            match = _PROCESS_FILE.match(os.path.basename(path))
+            if match and not _alive(int(match[1]),
+                                    match[2] and int(match[2])):
+                dead.append(path)
+        if not dead:
+            return
+        retired = os.path.join(directory, RETIRED)
+        dumps = [dump for dump in map(_load, [retired] + dead) if dump]
+        _write(directory, retired, _dump(*_merge(dumps)))
+        for path in dead:
+            os.remove(path)
+
+
+def flush(force=False):
+    """Пишет метрики процесса в общий каталог, если пора."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    interval = getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+    now = time.monotonic()
+    if not directory or (not force and now - _flushed['at'] < interval):
+        return
+    _flushed['at'] = now
+    os.makedirs(directory, exist_ok=True)
+    if directory not in _flushed['retired']:
+        _flushed['retired'].add(directory)
+        retire(directory)
+    _write(directory, _own_file(directory), registry.dump())
+
+
+def collect():
+    """Сумма метрик всех процессов: (counters, histograms)."""
+    dumps = [registry.dump()]
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if directory:
+        own = _own_file(directory)
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            if path != own:
+                dumps.append(_load(path))
+    return _merge(dump for dump in dumps if dump)
+
+
+def _merge(dumps):
+    counters, histograms = {}, {}
+    for dump in dumps:
+        for name, labels, value in dump['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in dump['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            for index, value in enumerate(values):
+                total[index] += value
+    return counters, histograms
+
+
+def _dump(counters, histograms):
+    return {
+        'counters': [[name, labels, value] for (name, labels), value
+                     in counters.items()],
+        'histograms': [[name, labels, values] for (name, labels), values
+                       in histograms.items()],
+    }
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"')
+               .replace('\n', r'\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value
+                          in zip(items, escaped)) + '}'
+
+
+def render():
+    counters, histograms = collect()
+    lines = []
+    for metric, (kind, help_text) in HELP.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        if kind == 'counter':
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f'{metric}{_labels(labels)} {value}')
+            continue
+        for (name, labels), values in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), values):
+                cumulative += count
+                lines.append(f'{metric}_bucket{_labels(labels, le=bound)} '
+                             f'{cumulative}')
+            lines.append(f'{metric}_sum{_labels(labels)} {values[-2]}')
+            lines.append(f'{metric}_count{_labels(labels)} {values[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def cache_lookup(cache_name, hit, **labels):
+    registry.inc('yatube_cache_requests_total',
+                 dict(labels, cache=cache_name,
+                      result='hit' if hit else 'miss'))
+
+
+def metrics_view(request):
+    """Метрики для Prometheus; доступны только с METRICS_ALLOWED_IPS."""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', settings.INTERNAL_IPS)
+    if request.META.get('REMOTE_ADDR') not in allowed:
+        raise Http404
+    return HttpResponse(render(),
+                        content_type='text/plain; version=0.0.4; '
+                                     'charset=utf-8')
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        # Запросы мимо URL-схемы сводятся к одной метке, иначе
+        # сканеры наплодили бы меток.
+        view = match.view_name if match else 'unresolved'
+        registry.observe('yatube_request_duration_seconds', {'view': view},
+                         elapsed)
+        registry.inc('yatube_responses_total',
+                     {'view': view, 'status': response.status_code})
+        flush()
+        return response
+
+
+class TimedTemplate:
+
+    def __init__(self, template):
+        self.template = template
+        self.origin = template.origin
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            registry.observe('yatube_template_render_seconds',
+                             {'template': self.origin.template_name},
+                             time.perf_counter() - started)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Бэкенд шаблонов Django, замеряющий рендер страниц целиком.
+
+    Вложенные include и extends рендерит движок, поэтому они входят
+    во время шаблона страницы, а не считаются отдельно.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
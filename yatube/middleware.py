@@ -0,0 +1,130 @@
+"""Учёт SQL-запросов каждого запроса к сайту, в том числе без DEBUG.
+
+SQLStatsMiddleware подключается к соединениям через execute_wrapper,
+поэтому ничего не копит в connection.queries и работает в продакшене.
+Запросы сводятся к «форме»: литералы и параметры заменяются на ?, списки
+IN (...) схлопываются. Если одна форма повторилась SQL_REPEAT_THRESHOLD
+раз, это похоже на N+1; такой запрос, как и медленный, попадает
+в журнал yatube.sql.slow вместе с именем view и строкой кода, откуда
+пришёл запрос. Итоги по каждому запросу пишутся в журнал yatube.sql,
+а при DEBUG или для адресов из INTERNAL_IPS — ещё и в заголовки ответа.
+"""
+import json
+import logging
+import os
+import re
+import time
+import traceback
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('yatube.sql')
+slow_logger = logging.getLogger('yatube.sql.slow')
+
+_STRINGS = re.compile(r"'(?:[^']|'')*'")
+_NUMBERS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_LISTS = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+_SPACES = re.compile(r'\s+')
+
+_THIS_FILE = os.path.abspath(__file__)
+
+
+def normalize(sql):
+    """Форма запроса: без литералов, параметров и длины списков IN."""
+    sql = _STRINGS.sub('?', sql)
+    sql = _NUMBERS.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _LISTS.sub('(...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def call_site():
+    """Ближайшая строка кода проекта, откуда выполнен запрос."""
+    for frame in reversed(traceback.extract_stack()):
+        path = os.path.abspath(frame.filename)
+        if ('site-packages' in path or path == _THIS_FILE
+                or not path.startswith(settings.BASE_DIR)):
+            continue
+        return f'{os.path.relpath(path, settings.BASE_DIR)}:{frame.lineno}'
+    return None
+
+
+class QueryStats:
+    """Счётчики одного запроса; вызывается как execute_wrapper."""
+
+    def __init__(self, repeat_threshold, slow_query_ms):
+        self.repeat_threshold = repeat_threshold
+        self.slow_query_ms = slow_query_ms
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+        self.repeated = {}
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.time += elapsed
+            shape = normalize(sql)
+            self.shapes[shape] += 1
+            # Стек разбирается только для подозрительных запросов.
+            if self.shapes[shape] == self.repeat_threshold:
+                self.repeated[shape] = call_site()
+            if elapsed >= self.slow_query_ms:
+                self.slow.append({'sql': shape, 'ms': round(elapsed, 1),
+                                  'site': call_site()})
+
+    def summary(self):
+        return {
+            'queries': self.count,
+            'sql_ms': round(self.time, 1),
+            'repeated': [{'sql': shape, 'count': self.shapes[shape],
+                          'site': site}
+                         for shape, site in self.repeated.items()],
+            'slow': self.slow,
+        }
+
+
+class SQLStatsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.repeat_threshold = getattr(settings, 'SQL_REPEAT_THRESHOLD', 5)
+        self.slow_query_ms = getattr(settings, 'SQL_SLOW_QUERY_MS', 100)
+        self.slow_request_ms = getattr(settings, 'SQL_SLOW_REQUEST_MS', 500)
+
+    def __call__(self, request):
+        stats = QueryStats(self.repeat_threshold, self.slow_query_ms)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(stats))
+            response = self.get_response(request)
+        total = (time.perf_counter() - started) * 1000
+
+        if (settings.DEBUG
+                or request.META.get('REMOTE_ADDR') in settings.INTERNAL_IPS):
+            response['X-SQL-Queries'] = str(stats.count)
+            response['X-SQL-Time'] = f'{stats.time:.1f}'
+            response['Server-Timing'] = (f'sql;dur={stats.time:.1f};'
+                                         f'desc="{stats.count} queries"')
+            if stats.repeated:
+                response['X-SQL-Repeated'] = str(len(stats.repeated))
+
+        match = getattr(request, 'resolver_match', None)
+        record = dict(stats.summary(), method=request.method,
+                      path=request.path, status=response.status_code,
+                      view=match.view_name if match else None,
+                      total_ms=round(total, 1))
+        logger.info(json.dumps(record, ensure_ascii=False))
+        if (stats.repeated or stats.slow
+                or total >= self.slow_request_ms):
+            slow_logger.warning(json.dumps(record, ensure_ascii=False))
+        return response
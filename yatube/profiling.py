@@ -0,0 +1,140 @@
+"""Профилирование отдельных запросов в продакшене.
+
+ProfilerMiddleware профилирует долю PROFILE_SAMPLE_RATE запросов и любой
+запрос с заголовком X-Profile, равным PROFILE_TOKEN. Режим задаёт
+PROFILE_MODE:
+
+* 'sampler' — отдельный поток раз в PROFILE_INTERVAL секунд снимает стек
+  потока запроса; результат — файл .collapsed в формате «кадр;кадр N»,
+  который сразу понимает flamegraph.pl и speedscope;
+* 'cprofile' — cProfile, результат — файл .prof для pstats.
+
+Файлы пишутся в PROFILE_DIR/<имя view>/, команда merge_profiles
+сводит их. Имя файла возвращается в заголовке X-Profile-File только
+на запросы с верным токеном.
+"""
+import cProfile
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+
+def frame_name(frame):
+    code = frame.f_code
+    path = code.co_filename
+    if path.startswith(settings.BASE_DIR):
+        path = os.path.relpath(path, settings.BASE_DIR)
+    return f'{code.co_name} ({path}:{code.co_firstlineno})'
+
+
+def collapse(frame):
+    """Стек от корня к кадру через ';', как у flamegraph."""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Снимает стек одного потока, пока не вызван stop()."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.stacks
+
+
+def write_collapsed(stacks, path):
+    with open(path, 'w', encoding='utf-8') as output:
+        for stack, count in stacks.most_common():
+            output.write(f'{stack} {count}\n')
+
+
+def read_collapsed(path):
+    stacks = Counter()
+    with open(path, encoding='utf-8') as source:
+        for line in source:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return stacks
+
+
+class ProfilerMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        self.token = getattr(settings, 'PROFILE_TOKEN', '')
+        self.mode = getattr(settings, 'PROFILE_MODE', 'sampler')
+        self.interval = getattr(settings, 'PROFILE_INTERVAL', 0.005)
+
+    def _authorized(self, request):
+        header = request.META.get('HTTP_X_PROFILE')
+        if header is None or not self.token:
+            return None
+        # WSGI отдаёт заголовки строками latin-1; compare_digest на str
+        # с не-ASCII символами падает с TypeError.
+        return hmac.compare_digest(header.encode('latin-1'),
+                                   self.token.encode())
+
+    def __call__(self, request):
+        authorized = self._authorized(request)
+        if authorized is None:
+            authorized = False
+            wanted = self.rate and random.random() < self.rate
+        else:
+            wanted = authorized
+        if not wanted:
+            return self.get_response(request)
+        if self.mode == 'cprofile':
+            profiler = cProfile.Profile()
+            response = profiler.runcall(self.get_response, request)
+            suffix = '.prof'
+        else:
+            sampler = StackSampler(threading.get_ident(), self.interval)
+            sampler.start()
+            try:
+                response = self.get_response(request)
+            finally:
+                stacks = sampler.stop()
+            suffix = '.collapsed'
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name.replace(':', '.') if match else 'unresolved'
+        directory = os.path.join(settings.PROFILE_DIR, view)
+        os.makedirs(directory, exist_ok=True)
+        name = (f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-'
+                f'{threading.get_ident()}-{random.randrange(10 ** 6)}'
+                f'{suffix}')
+        path = os.path.join(directory, name)
+        if suffix == '.prof':
+            profiler.dump_stats(path)
+        else:
+            write_collapsed(stacks, path)
+        if authorized:
+            response['X-Profile-File'] = os.path.join(view, name)
+        return response
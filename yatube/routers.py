@@ -0,0 +1,154 @@
+"""Маршрутизация между базами: реплики для чтения лент и отдельная
+база для таблиц с частыми записями.
+
+Реплики — псевдонимы из DATABASES, перечисленные в DATABASE_REPLICAS
+(например, локальные копии SQLite, которые обновляются снаружи).
+ReplicaMiddleware разрешает читать с реплики только GET- и HEAD-запросам
+к view из REPLICA_VIEWS. Всё остальное, включая любые записи, идёт
+в основную базу.
+
+Реплика может отставать, поэтому после запроса, который что-то записал,
+браузер получает cookie STICKY_COOKIE на REPLICA_STICKY_SECONDS секунд,
+и пока она есть, его запросы читают из основной базы — автор сразу
+видит свою запись или комментарий. Ленты, отрисованные с реплики, кэш
+лент хранит под отдельными ключами и не дольше REPLICA_STICKY_SECONDS
+(см. posts.caching), поэтому отставание реплик должно быть заметно
+меньше этого окна.
+
+У SQLite одна блокировка записи на файл, поэтому комментарии, подписки
+и сессии можно вынести в базу SOCIAL_DATABASE (SocialRouter). Связи
+между базами не проверяются ни SQLite, ни Django: внешние ключи этих
+моделей объявлены без ограничений и DO_NOTHING, удаление поста
+и пользователя разбирают сигналы, а запросы, которым нужны обе базы,
+делят подзапросы через across().
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, router
+
+STICKY_COOKIE = 'use_primary'
+
+_state = threading.local()
+
+
+SOCIAL_MODELS = {'posts.comment', 'posts.follow', 'sessions.session'}
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def current_replica():
+    """Реплика, с которой читает текущий запрос, или None."""
+    return getattr(_state, 'replica', None)
+
+
+def social_database():
+    return getattr(settings, 'SOCIAL_DATABASE', None)
+
+
+def _social_alias(model):
+    alias = social_database()
+    if alias and model._meta.label_lower in SOCIAL_MODELS:
+        return alias
+    return None
+
+
+def same_database(*models):
+    return len({router.db_for_read(model) for model in models}) == 1
+
+
+def across(queryset, model):
+    """Подзапрос queryset для запроса к model.
+
+    В одной базе подзапрос остаётся частью SQL, из другой базы значения
+    читаются заранее списком.
+    """
+    if same_database(queryset.model, model):
+        return queryset
+    return list(queryset)
+
+
+class SocialRouter:
+    """Комментарии, подписки и сессии — в базе SOCIAL_DATABASE."""
+
+    def db_for_read(self, model, **hints):
+        return _social_alias(model)
+
+    def db_for_write(self, model, **hints):
+        alias = _social_alias(model)
+        if alias:
+            _state.wrote = True
+        return alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        alias = social_database()
+        if alias and alias in (obj1._state.db, obj2._state.db):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        alias = social_database()
+        if not alias:
+            return None
+        if model_name is None:
+            # RunPython и RunSQL относятся к основной базе.
+            return db != alias
+        return (f'{app_label}.{model_name}' in SOCIAL_MODELS) == (db == alias)
+
+
+class ReplicaRouter:
+
+    @staticmethod
+    def _own(hints, *skip):
+        # Объект из подсказки тянет связанные модели в свою базу, но не
+        # из базы SOCIAL_DATABASE: остальных таблиц там нет.
+        instance = hints.get('instance')
+        if (instance is not None and instance._state.db
+                not in (None, social_database(), *skip)):
+            return instance._state.db
+        return DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        return getattr(_state, 'replica', None) or self._own(hints)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        # Объекты, прочитанные с реплики, сохраняются в основную базу.
+        return self._own(hints, *replicas())
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии основной базы, связи между ними допустимы.
+        allowed = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in allowed and obj2._state.db in allowed:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.replica, _state.wrote = None, False
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = _state.wrote
+            _state.replica, _state.wrote = None, False
+        if wrote:
+            response.set_cookie(STICKY_COOKIE, '1',
+                                max_age=settings.REPLICA_STICKY_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        available = replicas()
+        if (available and request.method in ('GET', 'HEAD')
+                and request.resolver_match.view_name
+                in settings.REPLICA_VIEWS
+                and STICKY_COOKIE not in request.COOKIES):
+            _state.replica = random.choice(available)
@@ -52,7 +52,12 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'yatube.metrics.MetricsMiddleware',
+    'yatube.profiling.ProfilerMiddleware',
+    'yatube.middleware.SQLStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Снаружи сессий, чтобы видеть и запись сессии в ответе.
+    'yatube.routers.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -67,7 +72,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'yatube.metrics.TimedDjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -93,6 +98,50 @@ DATABASES = {
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     }
 }
+# Ленты и профили читаются с реплик из DATABASE_REPLICAS (псевдонимы
+# DATABASES); после записи браузер REPLICA_STICKY_SECONDS секунд
+# читает из основной базы.
+DATABASE_ROUTERS = ['yatube.routers.SocialRouter',
+                    'yatube.routers.ReplicaRouter']
+DATABASE_REPLICAS = []
+REPLICA_VIEWS = ['index', 'group', 'profile', 'follow_index']
+REPLICA_STICKY_SECONDS = 10
+# Комментарии, подписки и сессии в своём файле SQLite, чтобы их запись
+# не ждала общей блокировки. Включение на существующей базе:
+# migrate --database social, затем split_databases.
+SOCIAL_DATABASE = None
+if os.environ.get('YATUBE_SPLIT_DATABASES'):
+    SOCIAL_DATABASE = 'social'
+if SOCIAL_DATABASE:
+    DATABASES['social'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'social.sqlite3'),
+    }
+# Профиль соединений SQLite (yatube/sqlite.py): PRAGMA на каждом новом
+# соединении и время жизни соединений. default ничего не меняет: режим
+# журнала хранится в файле базы, и переключённая в WAL база в нём
+# и остаётся. production — WAL, ожидание блокировки вместо ошибки
+# и соединения, переживающие запрос.
+SQLITE_PROFILES = {
+    'default': {
+        'PRAGMAS': {},
+        'CONN_MAX_AGE': 0,
+    },
+    'production': {
+        'PRAGMAS': {
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'mmap_size': 256 * 1024 * 1024,
+            'cache_size': -64 * 1024,
+            'busy_timeout': 20000,
+        },
+        'CONN_MAX_AGE': 600,
+    },
+}
+SQLITE_PROFILE = os.environ.get('YATUBE_SQLITE_PROFILE', 'default')
+for database in DATABASES.values():
+    database.setdefault(
+        'CONN_MAX_AGE', SQLITE_PROFILES[SQLITE_PROFILE]['CONN_MAX_AGE'])
 
 
 # Password validation
@@ -142,10 +191,79 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
 SITE_ID = 1
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'yatube.cache.TwoTierCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_TIMEOUT': 5,
+            # Поколения лент читаются только из общего кэша,
+            # иначе воркеры видели бы чужие записи с опозданием.
+            'LOCAL_SKIP': ['feed-generation:'],
+            'SINGLE_FLIGHT': ['views.decorators.cache.cache_header.',
+                              'views.decorators.cache.cache_page.',
+                              'feed-page.', 'template.cache.'],
+            # Попадания в фрагменты лент; страницы считает cache_feed.
+            'METRICS': {'template.cache.': 'fragment'},
+        },
     }
 }
+# Потоки, готовящие миниатюры; 0 — готовить прямо в запросе.
+POSTS_THUMBNAIL_WORKERS = 2
+# Загрузки пишутся на диск кусками и пережимаются в пуле процессов
+# из POSTS_IMAGE_WORKERS; 0 — прямо в запросе.
+FILE_UPLOAD_HANDLERS = ['posts.uploads.ImageUploadHandler']
+POSTS_IMAGE_WORKERS = 1
+POSTS_IMAGE_MAX_BYTES = 20 * 2 ** 20
+POSTS_IMAGE_MAX_PIXELS = 40_000_000
+POSTS_IMAGE_MAX_SIDE = 2560
+POSTS_IMAGE_QUALITY = 85
+# Ключи кэша лент версионируются, поэтому TTL может быть большим.
+POSTS_FEED_CACHE_TIMEOUT = 60 * 60
 
 INTERNAL_IPS = [
     "127.0.0.1",
 ]
+
+# Метрики воркеров сводятся через файлы в METRICS_DIR; отдаёт их
+# /metrics/ только адресам из METRICS_ALLOWED_IPS.
+METRICS_DIR = os.path.join(BASE_DIR, 'metrics')
+METRICS_FLUSH_INTERVAL = 5
+METRICS_ALLOWED_IPS = INTERNAL_IPS
+
+# Лента подписок: сколько постов хранить на подписчика и с какого
+# числа подписчиков посты автора читаются при запросе, а не раскладываются.
+POSTS_TIMELINE_LENGTH = 1000
+POSTS_FANOUT_MAX_FOLLOWERS = 5000
+
+# Файл картинки без ссылок удаляется не раньше чем через сутки.
+POSTS_IMAGE_GC_GRACE = 24 * 60 * 60
+
+# Учёт SQL по запросам: с какого числа повторов одной формы запроса
+# считать его N+1 и какие запрос к базе и ответ считать медленными.
+SQL_REPEAT_THRESHOLD = 5
+SQL_SLOW_QUERY_MS = 100
+SQL_SLOW_REQUEST_MS = 500
+
+# Профилирование запросов: доля случайных запросов и токен заголовка
+# X-Profile; пустой токен отключает профилирование по заголовку.
+PROFILE_SAMPLE_RATE = 0
+PROFILE_TOKEN = os.environ.get('YATUBE_PROFILE_TOKEN', '')
+PROFILE_MODE = 'sampler'
+PROFILE_INTERVAL = 0.005
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # Итоги каждого запроса видны с уровнем INFO.
+        'yatube.sql': {'handlers': ['console'],
+                       'level': 'INFO',
+                       'propagate': False},
+    },
+}
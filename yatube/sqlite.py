@@ -0,0 +1,35 @@
+"""Профили соединений SQLite.
+
+Профиль выбирается переменной окружения YATUBE_SQLITE_PROFILE и задаёт
+PRAGMA, которые выполняются на каждом новом соединении, и CONN_MAX_AGE
+для всех баз SQLite (см. SQLITE_PROFILES в settings). Профиль default
+PRAGMA не выполняет: режим журнала записан в файле базы, и база,
+переведённая в WAL, в нём и остаётся.
+
+В профиле production база работает в WAL: читатели не ждут писателя,
+а synchronous=NORMAL в WAL теряет при сбое питания не больше последних
+транзакций, но не портит файл. Модуль sqlite3 и так ждёт занятую базу
+5 секунд; busy_timeout продлевает ожидание до 20, чтобы писатели в пике
+нагрузки реже получали «database is locked». Соединения живут
+между запросами: Django закрывает их после ошибок и по CONN_MAX_AGE,
+а транзакции не остаются открытыми, поэтому WAL не разрастается.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def pragmas():
+    return settings.SQLITE_PROFILES[settings.SQLITE_PROFILE]['PRAGMAS']
+
+
+def apply_profile(connection):
+    with connection.cursor() as cursor:
+        for name, value in pragmas().items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        apply_profile(connection)
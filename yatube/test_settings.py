@@ -0,0 +1,41 @@
+"""Настройки тестов: manage.py test и pytest.
+
+Кэш — тот же TwoTierCache, что и в работе, но в своём временном
+каталоге: тестовая база пересоздаётся, и страницы из общего кэша
+разработки в тесты попасть не должны.
+"""
+import atexit
+import copy
+import os
+import shutil
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, CACHES, DATABASES, LOGGING
+
+DATABASES = {
+    **DATABASES,
+    # Базы, на которых тесты проверяют маршрутизацию; сами маршруты
+    # включаются в тестах через override_settings.
+    'social': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'social.sqlite3'),
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+    },
+}
+
+CACHE_DIR = tempfile.mkdtemp(prefix='yatube-cache-')
+atexit.register(shutil.rmtree, CACHE_DIR, ignore_errors=True)
+CACHES = copy.deepcopy(CACHES)
+CACHES['default']['LOCATION'] = CACHE_DIR
+
+# Миниатюры готовятся и загрузки пережимаются прямо в запросе.
+POSTS_THUMBNAIL_WORKERS = 0
+POSTS_IMAGE_WORKERS = 0
+METRICS_DIR = None
+
+LOGGING = copy.deepcopy(LOGGING)
+LOGGING['loggers']['yatube.sql']['level'] = 'ERROR'
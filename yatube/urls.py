@@ -20,9 +20,11 @@ from django.conf.urls import handler404, handler500 # noqa
 from django.conf import settings
 from django.conf.urls.static import static
 from django.conf import settings
+from yatube.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', metrics_view, name='metrics'),
     path('about/', include('django.contrib.flatpages.urls')),
     path("auth/", include("users.urls")),
     path("auth/", include("django.contrib.auth.urls")),